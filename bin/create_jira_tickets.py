@@ -2,20 +2,25 @@
 
 Creates JIRA issues from a list of hypervisors and updates the file with the
 generated issue IDs.  If an issue already exists with the same summary the
-existing issue key is used instead of creating a new ticket.
+existing issue key is used instead of creating a new ticket.  Existing issues
+are looked up, and the new ones created, in bulk.
 """
 
 import os
-import sys
+import re
 import jira
 import argparse
+import tempfile
 import yaml
 
 
 
-def create_jira_issues_from_file(filename, username, api_token):
+def create_jira_issues_from_file(filename, username, api_token, chunk_size=50):
     """
     Create Jira issues for each hypervisor listed in ``filename``.
+    Existing issues for all the hostnames are looked up with a few JQL
+    searches, the missing ones are created with the bulk-create endpoint,
+    and the file is rewritten atomically once at the end.
     Parameters
     ----------
     filename : str
@@ -24,6 +29,8 @@ def create_jira_issues_from_file(filename, username, api_token):
         username allowed to create JIRA tickets
     api_token : str
         API token for that username
+    chunk_size : int
+        Maximum number of hostnames per JQL search and per bulk-create request
     Returns
     -------
     bool
@@ -60,60 +67,118 @@ def create_jira_issues_from_file(filename, username, api_token):
         print("No words found in the file.")
         return False
     
-    # Process each word and create JIRA issues
-    updated_lines = []
-    
+    # Skip lines that already have an issue ID (contain a space)
+    words = []
     for i, word in enumerate(lines, 1):
-        # Skip if line already has an issue ID (contains space)
         if ' ' in word:
             print(f"Skipping line {i}: '{word}' (already has issue ID)")
-            updated_lines.append(word)
-            continue
-            
+        else:
+            words.append(word)
+
+    # Check which words already have an issue with the same summary
+    (issue_keys, ambiguous) = find_existing_issues(conn, project_key, words, chunk_size)
+    for word, issue_key in issue_keys.items():
+        print(f"Found existing issue {issue_key} for '{word}'")
+    for word, keys in ambiguous.items():
+        print(f"Error: several existing issues for '{word}': {', '.join(keys)}. Add the right one to the file by hand")
+
+    # Create the JIRA issues for the rest
+    missing = [word for word in words if word not in issue_keys and word not in ambiguous]
+    if missing:
         try:
-            # Check if an issue already exists with the same summary
-            jql = f'project = {project_key} AND summary ~ "{word}"'
-            existing = conn.search_issues(jql, maxResults=1)
-            if existing:
-                issue_key = existing[0].key
-                print(f"Found existing issue {issue_key} for '{word}'")
-                updated_lines.append(f"{word} {issue_key}")
-                continue
+            # resolved once here, otherwise create_issues() resolves them for every issue
+            project_id = conn.project(project_key).id
+            issue_type_id = conn.issue_type_by_name(issue_type, project=project_id).id
         except Exception as e:
-            print(f"Error searching existing issue for '{word}': {e}")
-
-        try:
-            # Create JIRA issue
-            issue_dict = {
-                'project': project_key,
+            print(f"Error getting the details of project {project_key}: {e}")
+            missing = []
+    for chunk in chunks(missing, chunk_size):
+        field_list = [
+            {
+                'project': {'id': project_id},
                 'summary': word,
                 'description': f'Issue created for: {word}',
-                'issuetype': {'name': issue_type},
+                'issuetype': {'id': issue_type_id},
                 'assignee': {'accountId': my_accountId},
             }
-
-            new_issue = conn.create_issue(fields=issue_dict)
-            issue_key = new_issue.key
-
-            print(f"Created issue {issue_key} for '{word}'")
-            updated_lines.append(f"{word} {issue_key}")
-
+            for word in chunk
+        ]
+        try:
+            created = conn.create_issues(field_list=field_list, prefetch=False)
         except Exception as e:
-            print(f"Error creating issue for '{word}': {e}")
-            # Keep the original word without issue ID if creation fails
-            updated_lines.append(word)
+            print(f"Error creating issues for {chunk}: {e}")
+            continue
+        for word, result in zip(chunk, created):
+            if result['status'] == 'Success':
+                issue_keys[word] = result['issue'].key
+                print(f"Created issue {issue_keys[word]} for '{word}'")
+            else:
+                print(f"Error creating issue for '{word}': {result['error']}")
+
+    # Keep the original word without issue ID if creation failed
+    updated_lines = []
+    for line in lines:
+        if line in issue_keys:
+            updated_lines.append(f"{line} {issue_keys[line]}")
+        else:
+            updated_lines.append(line)
     
-    # Write updated content back to file
+    # Write updated content back to file, atomically
     try:
-        with open(filename, 'w') as f:
+        directory = os.path.dirname(os.path.abspath(filename))
+        with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as f:
             for line in updated_lines:
                 f.write(line + '\n')
+        os.replace(f.name, filename)
         print(f"\nFile '{filename}' updated successfully!")
-        return True
+        return len(issue_keys) == len(words)
     except Exception as e:
         print(f"Error writing to file: {e}")
         return False
 
+
+def find_existing_issues(conn, project_key, words, chunk_size):
+    """
+    Search for existing issues whose summary matches each word,
+    with one paginated JQL search per chunk of words.
+    An issue matches a word if its summary is the word, or else contains
+    it as a whole hostname (so hv1 does not match hv10). A word matching
+    several issues is ambiguous, and none of them is used.
+    Returns
+    -------
+    tuple(dict, dict)
+        issue key for each word with a single existing issue, and the
+        issue keys for each ambiguous word
+    """
+    issue_keys = {}
+    ambiguous = {}
+    for chunk in chunks(words, chunk_size):
+        summaries = " OR ".join(f'summary ~ "{word}"' for word in chunk)
+        jql = f'project = {project_key} AND ({summaries}) ORDER BY key ASC'
+        try:
+            existing = conn.search_issues(jql, fields="summary", maxResults=False)
+        except Exception as e:
+            print(f"Error searching existing issues for {chunk}: {e}")
+            continue
+        for word in chunk:
+            # prefer an exact match, otherwise any issue mentioning the whole word
+            matches = [issue for issue in existing if issue.fields.summary.strip() == word]
+            if not matches:
+                pattern = re.compile(rf"(?<![\w.-]){re.escape(word)}(?![\w.-])")
+                matches = [issue for issue in existing if pattern.search(issue.fields.summary)]
+            if len(matches) == 1:
+                issue_keys[word] = matches[0].key
+            elif matches:
+                ambiguous[word] = [issue.key for issue in matches]
+    return issue_keys, ambiguous
+
+
+def chunks(items, size):
+    """
+    Split a list into lists of at most ``size`` items
+    """
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
     
 
 # ============================================================================== 
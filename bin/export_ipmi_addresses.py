@@ -0,0 +1,52 @@
+"""IPMI Address Export Script
+
+Resolves, from NetBox, the IPMI (bmc0) address of every hypervisor listed
+in the hypervisors file, and writes them as CSV or JSON for the data-centre
+team.
+"""
+
+import argparse
+import os
+import sys
+
+# make the lib/ package importable when running from the bin/ directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.migrationmanager import MigrationManager
+
+
+# ==============================================================================
+#   main
+# ==============================================================================
+
+def parse_arguments():
+    """
+    Parse command line arguments for the script
+    """
+    parser = argparse.ArgumentParser(
+        description="Script to export the IPMI addresses of the hypervisors"
+    )
+    parser.add_argument(
+        '--hypervisors-file',
+        default='etc/hypervisors.txt',
+        help='Path to the hypervisors file (default: etc/hypervisors.txt)'
+    )
+    parser.add_argument(
+        '--creds-file',
+        default='etc/creds.yaml',
+        help='Path to the credentials file (default: etc/creds.yaml)'
+    )
+    parser.add_argument(
+        '--output',
+        default=None,
+        help='Output file, JSON if it ends with .json, CSV otherwise (default: CSV to stdout)'
+    )
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    manager = MigrationManager(args.creds_file, args.hypervisors_file)
+    try:
+        manager.netbox_inventory.export_ipmi_addresses(args.output)
+    finally:
+        manager.close()
@@ -1,6 +1,34 @@
+"""JIRA Ticket Update Script
+
+Adds the same internal comment to every JIRA ticket listed in the
+hypervisors file.  The comment can be a template, where ``$hostname`` and
+``$ticket`` are replaced for each ticket.  The comments are posted
+concurrently, within a shared rate limit, and the outcome of each one is
+reported at the end.
+"""
+
+import argparse
+import os
+import string
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import jira
+import requests
+import yaml
+
+# make the lib/ package importable when running from the bin/ directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-def get_list_of_jira_tickets(filename)
+from lib.argtypes import positive_float
+from lib.ratelimit import RateLimiter
+
+
+def get_list_of_jira_tickets(filename):
+    """
+    Return the (hostname, ticket) pairs listed in the hypervisors file
+    """
     jira_tickets_l = []
     with open(filename, 'r') as file:
         for line in file:
@@ -14,25 +42,101 @@ def get_list_of_jira_tickets(filename)
                 continue
             # 2. Split the line into columns based on whitespace
             columns = cleaned_line.split()
-            jira_tickets_l.append(columns[1])
+            # Skip hypervisors without a ticket yet
+            if len(columns) < 2:
+                print(f"Skipping '{columns[0]}' (no JIRA ticket)")
+                continue
+            jira_tickets_l.append((columns[0], columns[1]))
     return jira_tickets_l
 
-def update_jira_tickets(filename, username, api_token, comment):
-    issue_type = "HyperVisor"
-    project_key = "MH"
+
+def update_jira_tickets(filename, username, api_token, comment, max_workers=16, rate=10):
+    """
+    Add a comment to each JIRA ticket listed in ``filename``.
+    Parameters
+    ----------
+    filename : str
+        Path to the hypervisors file, with the ticket in the second column.
+    username : str
+        username allowed to comment on the JIRA tickets
+    api_token : str
+        API token for that username
+    comment : str
+        text of the comment. ``$hostname`` and ``$ticket`` are replaced
+        by the values for each ticket. ``$$`` is a literal ``$``.
+    max_workers : int
+        maximum number of comments posted at the same time
+    rate : float
+        maximum number of calls to JIRA per second
+    Returns
+    -------
+    bool
+        ``True`` if all tickets were updated, ``False`` otherwise.
+    """
+    # string.Template rather than str.format, as JIRA markup uses {code}, {noformat}...
+    template = string.Template(comment)
 
     # Connect to JIRA
     try:
         endpoint = "https://stfc.atlassian.net/"
-        conn = jira.client.JIRA(server=endpoint, basic_auth=(username, api_token))
+        conn = jira.client.JIRA(
+            server=endpoint,
+            basic_auth=(username, api_token),
+            get_server_info=False,
+            # retries of throttled calls are handled by the RateLimiter
+            max_retries=0,
+        )
     except Exception as e:
         print(f"Error connecting to JIRA: {e}")
         return False
-    jira_tickets_l = get_list_of_jira_tickets(filename)
-    for ticket_id in jira_tickets_l:
-        conn.add_comment(ticket_id, comment, is_internal=True)
+    # keep one HTTP connection per worker
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    conn._session.mount("https://", adapter)
+    rate_limiter = RateLimiter(rate=rate, burst=2 * rate)
+
+    try:
+        jira_tickets_l = get_list_of_jira_tickets(filename)
+    except FileNotFoundError:
+        print(f"Error: File '{filename}' not found.")
+        return False
 
+    # validate the template before posting anything
+    try:
+        for hostname, ticket_id in jira_tickets_l:
+            template.substitute(hostname=hostname, ticket=ticket_id)
+    except (KeyError, ValueError) as e:
+        print(f"Error in the comment template: {e!r}")
+        return False
 
+    def add_comment(hostname, ticket_id):
+        text = template.substitute(hostname=hostname, ticket=ticket_id)
+        start = time.monotonic()
+        try:
+            rate_limiter.call(conn.add_comment, ticket_id, text, is_internal=True)
+            error = None
+        except Exception as e:
+            error = e
+        return hostname, ticket_id, time.monotonic() - start, error
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(add_comment, *pair) for pair in jira_tickets_l]
+        results = [future.result() for future in futures]
+    elapsed = time.monotonic() - start
+
+    print()
+    print("Summary:")
+    for hostname, ticket_id, ticket_elapsed, error in results:
+        line = f"  {hostname} {ticket_id}: {'ok' if error is None else 'error'} ({ticket_elapsed:.1f}s)"
+        if error is not None:
+            line += f" {error}"
+        print(line)
+    failed = len([result for result in results if result[3] is not None])
+    print(f"  ok: {len(results) - failed}")
+    print(f"  error: {failed}")
+    print(f"  {len(results)} tickets in {elapsed:.1f}s")
+    print(f"  JIRA API usage: {rate_limiter.summary}")
+    return failed == 0
 
 
 # ==============================================================================
@@ -44,7 +148,7 @@ def parse_arguments():
     Parse command line arguments for the script
     """
     parser = argparse.ArgumentParser(
-        description="Script to create the JIRA tickets"
+        description="Script to add a comment to all the JIRA tickets"
     )
     parser.add_argument(
         '--hypervisors-file',
@@ -58,7 +162,22 @@ def parse_arguments():
     )
     parser.add_argument(
         '--comment',
-        help='comment to pass to all JIRA tickets'
+        required=True,
+        help='comment to pass to all JIRA tickets. '
+             '$hostname and $ticket are replaced for each ticket'
+    )
+    parser.add_argument(
+        '--max-workers',
+        type=int,
+        default=16,
+        help='Maximum number of comments posted at the same time (default: 16)'
+    )
+    parser.add_argument(
+        '--jira-rate',
+        type=positive_float,
+        default=10,
+        help='Maximum number of calls to JIRA per second (default: 10)'
+    )
     return parser.parse_args()
 
 if __name__ == '__main__':
@@ -67,5 +186,8 @@ if __name__ == '__main__':
         config = yaml.safe_load(f)
     username = config["jira"]["username"]
     api_token = config["jira"]["api_token"]
-    success = update_jira_tickets(args.hypervisors_file, username, api_token, args.comment)
-
+    success = update_jira_tickets(
+        args.hypervisors_file, username, api_token, args.comment,
+        max_workers=args.max_workers, rate=args.jira_rate
+    )
+    sys.exit(0 if success else 1)
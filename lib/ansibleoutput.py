@@ -0,0 +1,237 @@
+import collections
+import heapq
+import re
+import time
+from dataclasses import dataclass
+
+
+# e.g. "PLAY [Configure the hypervisors] ****"
+HEADER_LINE = re.compile(r"^(?P<kind>PLAY|TASK|RUNNING HANDLER) \[(?P<name>.*)\]")
+
+# e.g. "changed: [hv01]", "ok: [hv01] => (item=eth0)", "fatal: [hv01 -> localhost]: FAILED! => {...}"
+RESULT_LINE = re.compile(r"^(?P<status>ok|changed|skipping|failed|fatal): \[(?P<host>[^\]\s]+)(?: -> [^\]]*)?\](?P<rest>.*)$")
+
+# e.g. "hv01.nubes.rl.ac.uk : ok=12 changed=3 unreachable=0 failed=0 skipped=5 rescued=0 ignored=0"
+RECAP_LINE = re.compile(r"^(?P<host>\S+)\s+:\s+(?P<counts>(\w+=\d+\s*)+)$")
+
+# longest line kept, a fatal line may carry the whole output of a task
+MAX_LINE_SIZE = 2000
+
+
+@dataclass
+class TaskEvent:
+    """
+    result of a task for a host, as printed by the playbook
+    """
+    play: str
+    task: str
+    host: str
+    status: str  # ok, changed, skipping, failed or unreachable
+    elapsed: float  # seconds since the task started
+    line: str
+
+
+class AnsibleOutputParser:
+    def __init__(self, hosts=None, abort_on_fatal=False, max_lines=50, slowest=5, clock=time.monotonic):
+        """
+        Incremental parser for the output of ansible-playbook and kayobe,
+        fed line by line while the playbook runs
+
+        Only a bounded summary is kept, whatever the size of the output:
+        the counters of each host, its last failures, the PLAY RECAP,
+        the slowest tasks and the last lines that are not task results.
+
+        Parameters
+        ----------
+        hosts : list of str, optional
+            Hosts targeted by the playbook.
+        abort_on_fatal : bool
+            Whether the playbook should be stopped once every host in hosts
+            (or any host, if hosts is not given) had a fatal error that was
+            neither ignored nor rescued.
+        max_lines : int
+            Maximum number of failure lines kept per host,
+            and of other lines kept in total.
+        slowest : int
+            Number of slowest tasks kept.
+        clock : callable
+            Source of the timestamps, in seconds.
+        """
+        self.hosts = list(hosts) if hosts else []
+        self.abort_on_fatal = abort_on_fatal
+        self.max_lines = max_lines
+        self.slowest = slowest
+        self.clock = clock
+        self.play = ""
+        self.task = ""
+        self.counts = collections.defaultdict(collections.Counter)
+        self.recap = {}
+        self.fatal = collections.Counter()
+        self._failures = collections.defaultdict(lambda: collections.deque(maxlen=self.max_lines))
+        self._other = collections.deque(maxlen=max_lines)
+        self._slowest = []
+        self._task_started = clock()
+        self._last_fatal = None
+        # hosts with a fatal error that may still be ignored or rescued,
+        # with the number of task headers seen since, and hosts known to be
+        # out of the playbook
+        self._pending = {}
+        self._down = set()
+        self._in_recap = False
+        self.lines = 0
+
+    def feed(self, line):
+        """
+        Parse the next line of output
+        Returns
+        -------
+        list of TaskEvent
+            The task results found in the line, if any.
+        """
+        self.lines += 1
+        line = line.rstrip("\n")
+        if len(line) > MAX_LINE_SIZE:
+            line = line[:MAX_LINE_SIZE] + " [... line truncated ...]"
+        stripped = line.strip()
+        if not stripped:
+            self._in_recap = False
+            return []
+        if line.startswith("PLAY RECAP"):
+            self._end_task()
+            self._in_recap = True
+            return []
+        if self._in_recap:
+            match = RECAP_LINE.match(stripped)
+            if match:
+                counts = self.recap.setdefault(match.group("host"), {})
+                for counter in match.group("counts").split():
+                    (name, value) = counter.split("=")
+                    counts[name] = counts.get(name, 0) + int(value)
+                if self.failed(match.group("host")):
+                    self._down.add(match.group("host"))
+                return []
+        if stripped.startswith("NO MORE HOSTS LEFT"):
+            # the playbook gave up on all the hosts that failed
+            self._down.update(self._pending)
+            self._pending = {}
+        match = HEADER_LINE.match(line)
+        if match:
+            self._end_task()
+            self._settle()
+            if match.group("kind") == "PLAY":
+                self.play = match.group("name")
+                self.task = ""
+            else:
+                self.task = match.group("name")
+            return []
+        if stripped == "...ignoring" and self._last_fatal:
+            self.fatal[self._last_fatal] -= 1
+            self._pending.pop(self._last_fatal, None)
+            self._failures[self._last_fatal].append(stripped)
+            self._last_fatal = None
+            return []
+        match = RESULT_LINE.match(line)
+        if not match:
+            if not line.startswith("included:"):
+                self._other.append(line)
+            return []
+        host = match.group("host")
+        status = match.group("status")
+        if status in ("failed", "fatal"):
+            status = "unreachable" if "UNREACHABLE!" in match.group("rest") else "failed"
+            self.fatal[host] += 1
+            self._last_fatal = host
+            self._pending[host] = 0
+        elif host in self._pending:
+            # a result after a fatal error, in a rescue block
+            del self._pending[host]
+            self._failures[host].append(f"TASK [{self.task}]")
+            self._failures[host].append(line)
+        self.counts[host][status] += 1
+        return [TaskEvent(self.play, self.task, host, status, self.clock() - self._task_started, line)]
+
+    def _end_task(self):
+        """
+        Record how long the current task took, and start timing the next one
+        """
+        now = self.clock()
+        if self.task:
+            entry = (now - self._task_started, f"{self.play} / {self.task}")
+            if len(self._slowest) < self.slowest:
+                heapq.heappush(self._slowest, entry)
+            else:
+                heapq.heappushpop(self._slowest, entry)
+        self._task_started = now
+
+    def _settle(self):
+        """
+        At a task header: a fatal error can only be followed by
+        "...ignoring" before the next task, and by the results of a
+        rescue block in the next task. A host with no result since then
+        is out of the playbook.
+        """
+        for host in list(self._pending):
+            self._pending[host] += 1
+            if self._pending[host] > 1:
+                del self._pending[host]
+                self._down.add(host)
+
+    @property
+    def should_abort(self):
+        """
+        Whether the rest of the playbook is not worth waiting for:
+        every host (or any host, without a list of hosts) had a fatal
+        error that was neither ignored nor rescued
+        """
+        if not self.abort_on_fatal:
+            return False
+        if self.hosts:
+            return set(self.hosts) <= self._down
+        return bool(self._down)
+
+    @property
+    def failed_hosts(self):
+        """
+        Hosts the playbook failed for
+        """
+        return {host for host in set(self.recap) | set(self.fatal) if self.failed(host)}
+
+    def failed(self, hostname):
+        """
+        Whether the playbook failed for a host: from its PLAY RECAP line,
+        or, without one (e.g. the playbook was stopped), from its fatal errors.
+        Returns None when there is nothing about this host in the output.
+        """
+        counts = self.recap.get(hostname)
+        if counts is not None:
+            return bool(counts.get("failed", 0) or counts.get("unreachable", 0))
+        if self.fatal.get(hostname, 0) > 0:
+            return True
+        if hostname in self.counts:
+            return False
+        return None
+
+    def report(self, hostname=None):
+        """
+        Summary of the output, for all hosts or only one:
+        the failures, the PLAY RECAP, the slowest tasks,
+        and the last lines that are not task results
+        """
+        hosts = [hostname] if hostname else sorted(set(self._failures) | set(self.recap))
+        msg = []
+        if self._other:
+            msg.append("\n".join(self._other))
+        failures = [line for host in hosts for line in self._failures.get(host, [])]
+        if failures:
+            msg.append("failures:\n" + "\n".join(failures))
+        recap = [
+            f"{host} : " + " ".join(f"{name}={value}" for (name, value) in self.recap[host].items())
+            for host in hosts if host in self.recap
+        ]
+        if recap:
+            msg.append("PLAY RECAP\n" + "\n".join(recap))
+        if self._slowest:
+            msg.append("slowest tasks:\n" + "\n".join(
+                f"{elapsed:.1f}s {task}" for (elapsed, task) in sorted(self._slowest, reverse=True)
+            ))
+        return "\n\n".join(msg)
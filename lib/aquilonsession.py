@@ -0,0 +1,265 @@
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from lib.batchcollector import BatchCollector
+from lib.hvlocal import Results, iter_lines
+
+
+AQUILON_HOST = "aquilon.gridpp.rl.ac.uk"
+
+# environment for the Aquilon commands
+AQUILON_ENV = (
+    "export AQHOST=aquilon.gridpp.rl.ac.uk; export AQSERVICE=aqd;"
+    "export PATH=/opt/aquilon/bin/:$PATH;"
+    "export PATH=/var/quattor/bin/:$PATH;"
+)
+
+# location of the helper scripts in the HOME directory on the Aquilon host
+SCRIPTS_DIR = "./no_way_i_am_doing_this_manually/scripts"
+
+
+class MyaqWorker:
+    def __init__(self, transport):
+        """
+        scripts/myaq_worker.py running on the Aquilon host, on its own
+        channel of the shared connection, for as long as the channel is open.
+        Each request is a JSON line written to its stdin, and each
+        response a JSON line read from its stdout.
+
+        Parameters
+        ----------
+        transport : paramiko.Transport
+            Connection to the Aquilon host.
+        """
+        self.channel = transport.open_session()
+        self.channel.exec_command(AQUILON_ENV + f"python3 {SCRIPTS_DIR}/myaq_worker.py")
+        self.stdin = self.channel.makefile("wb")
+        self.stdout = self.channel.makefile("rb")
+        self._ids = itertools.count(1)
+
+    def call(self, action, hostname):
+        """
+        Run an action for a HyperVisor in the worker
+        Returns
+        -------
+        dict
+            Response from the worker, with keys hostname, cmd, out, err and rc.
+        """
+        request = {"id": next(self._ids), "action": action, "hostname": hostname}
+        self.stdin.write(json.dumps(request).encode("utf-8") + b"\n")
+        self.stdin.flush()
+        line = self.stdout.readline()
+        if not line:
+            stderr = self.channel.makefile_stderr("rb").read().decode("utf-8", "replace")
+            raise EOFError(f"myaq worker exited: {stderr.strip()}")
+        response = json.loads(line)
+        if response.get("id") != request["id"]:
+            raise ValueError(f"unexpected response from myaq worker: {line!r}")
+        return response
+
+    def close(self):
+        """
+        Close the stdin of the worker, so it exits, and the channel
+        """
+        try:
+            self.channel.shutdown_write()
+        finally:
+            self.channel.close()
+
+
+@dataclass
+class CommandTiming:
+    """
+    time spent by a command waiting in the queue, and running
+    """
+    queued: float
+    elapsed: float
+
+    @property
+    def report(self):
+        return f"queued for {self.queued:.1f}s, ran for {self.elapsed:.1f}s"
+
+
+class AquilonSession:
+    def __init__(self, migration_manager, concurrency=None, batch_window=0, batch_size=50, worker=False):
+        """
+        Single SSH session to the Aquilon host, shared by all the HyperVisors
+
+        The aqd broker processes the commands one after another anyway,
+        so instead of each HyperVisor logging in for each command, all
+        the commands are queued and run, a few at a time, on new channels
+        of one pooled, kept-alive, connection.
+
+        Parameters
+        ----------
+        migration_manager : MigrationManager
+            Manager providing the SSH pool, credentials and service limits.
+        concurrency : int, optional
+            Maximum number of commands running at the same time.
+            By default, the limit for service "aquilon", or 1 if not capped.
+        batch_window : float
+            If not 0, the helper scripts are run once for many HyperVisors,
+            waiting up to this number of seconds for them to be ready.
+        batch_size : int
+            Maximum number of HyperVisors in a single run of a helper script.
+        worker : bool
+            Run the myaq actions in resident workers (scripts/myaq_worker.py),
+            one per thread of the queue, instead of a new process each time.
+        """
+        self.ssh_pool = migration_manager.ssh_pool
+        self.creds_handler = migration_manager.credentials_handler
+        if concurrency is None:
+            concurrency = migration_manager.service_limits.limit("aquilon") or 1
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="aquilon")
+        self.participants = migration_manager.participants
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self._collectors = {}
+        self._lock = threading.Lock()
+        self.worker = worker
+        self._workers = []
+        self._local = threading.local()
+
+    def run(self, cmd, stdin_data=None):
+        """
+        Queue a command, and wait for it to be run on the Aquilon host
+        Parameters
+        ----------
+        cmd : str
+            Command line to execute, without the Aquilon environment.
+        stdin_data : str, optional
+            Data to feed to the standard input of the command.
+        Returns
+        -------
+        tuple(Results, CommandTiming)
+            Output of the command, and the time it waited and ran.
+        """
+        submitted = time.monotonic()
+        future = self._executor.submit(self._exec, cmd, submitted, stdin_data)
+        return future.result()
+
+    def run_script(self, script, hostnames):
+        """
+        Run a helper script once for many HyperVisors
+        Parameters
+        ----------
+        script : str
+            Name of the script in SCRIPTS_DIR, e.g. "make_host.py".
+        hostnames : list of str
+            HyperVisors to run the script for.
+        Returns
+        -------
+        dict
+            For each hostname, a tuple(Results, CommandTiming),
+            with the output of the script for that HyperVisor.
+        """
+        cmd = f"python3 {SCRIPTS_DIR}/{script} --json -"
+        results, timing = self.run(cmd, stdin_data=json.dumps(list(hostnames)))
+        per_host = {}
+        for line in iter_lines(results.stdout):
+            try:
+                host = json.loads(line)
+            except ValueError:
+                continue
+            per_host[host["hostname"]] = (
+                Results(host["cmd"], host["out"], host["err"], host["rc"]),
+                timing,
+            )
+        for hostname in hostnames:
+            if hostname not in per_host:
+                # e.g. the script crashed before getting to this one
+                error = f"no result for {hostname} from {cmd}\n{results.stderr}"
+                per_host[hostname] = (Results(cmd, "", error, results.rc or 1), timing)
+        return per_host
+
+    def call(self, action, hostname):
+        """
+        Queue a myaq action for a HyperVisor, and wait for a worker to run it
+        Returns
+        -------
+        tuple(Results, CommandTiming)
+            Output of the action, and the time it waited and ran.
+        """
+        submitted = time.monotonic()
+        future = self._executor.submit(self._call, action, hostname, submitted)
+        return future.result()
+
+    def _call(self, action, hostname, submitted):
+        """
+        Body of the queue: run an action in the worker of this thread
+        """
+        started = time.monotonic()
+        worker = self._worker()
+        try:
+            response = worker.call(action, hostname)
+        except Exception:
+            # the worker is in an unknown state, start a new one next time.
+            # The action is not retried, it may have been done already.
+            self._local.worker = None
+            worker.close()
+            raise
+        timing = CommandTiming(started - submitted, time.monotonic() - started)
+        results = Results(response["cmd"] or f"{action} {hostname}", response["out"], response["err"], response["rc"])
+        return results, timing
+
+    def _worker(self):
+        """
+        Return the worker of the current thread, starting it if needed
+        """
+        worker = getattr(self._local, "worker", None)
+        if worker is None or worker.channel.closed:
+            transport = self.ssh_pool.get_transport(
+                AQUILON_HOST,
+                self.creds_handler.aquilon.username,
+                password=self.creds_handler.aquilon.password,
+            )
+            worker = MyaqWorker(transport)
+            self._local.worker = worker
+            with self._lock:
+                self._workers.append(worker)
+        return worker
+
+    def batch(self, script):
+        """
+        Return the BatchCollector gathering the HyperVisors
+        that need to run a helper script
+        """
+        with self._lock:
+            if script not in self._collectors:
+                self._collectors[script] = BatchCollector(
+                    lambda items: self.run_script(script, list(items)),
+                    self.participants,
+                    window=self.batch_window,
+                    max_size=self.batch_size,
+                )
+            return self._collectors[script]
+
+    def _exec(self, cmd, submitted, stdin_data=None):
+        """
+        Body of the queue: run a command on a channel of the shared connection
+        """
+        started = time.monotonic()
+        results = self.ssh_pool.exec_command(
+            AQUILON_HOST,
+            self.creds_handler.aquilon.username,
+            AQUILON_ENV + cmd,
+            password=self.creds_handler.aquilon.password,
+            stdin_data=stdin_data,
+        )
+        timing = CommandTiming(started - submitted, time.monotonic() - started)
+        # report the command as it was requested, without the environment
+        return Results(cmd, results.stdout, results.stderr, results.rc), timing
+
+    def close(self):
+        """
+        Stop accepting commands, once the queued ones are done,
+        and stop the workers
+        """
+        self._executor.shutdown(wait=True)
+        for worker in self._workers:
+            worker.close()
+        self._workers = []
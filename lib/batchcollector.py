@@ -0,0 +1,140 @@
+import contextlib
+import threading
+import time
+
+
+class Participants:
+    def __init__(self):
+        """
+        Keys (e.g. hostnames) of the HyperVisors currently running a step,
+        i.e. the ones a BatchCollector may wait for
+        """
+        self._active = set()
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def active(self, key):
+        """
+        Context manager to hold while a HyperVisor is running a step
+        """
+        with self._lock:
+            self._active.add(key)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active.discard(key)
+                collectors = list(self._collectors)
+            # a collector may have been waiting for this one
+            for collector in collectors:
+                collector.wake_up()
+
+    def snapshot(self):
+        with self._lock:
+            return set(self._active)
+
+    def register(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+
+class BatchCollector:
+    def __init__(self, func, participants, window=10, max_size=None):
+        """
+        Collect the requests of many HyperVisors into a single call
+
+        The first HyperVisor to submit an item becomes the leader of
+        the batch. It waits until every active participant not served
+        yet has submitted its item (or has skipped this collector), the
+        batch is full, or the window expires, whichever happens first.
+        Then it calls func once with all the items, and every HyperVisor
+        gets back its own result.
+
+        Parameters
+        ----------
+        func : callable
+            Called as func(items), with a dict of items keyed by participant.
+            Returns a dict with the result for each key.
+        participants : Participants
+            HyperVisors currently running the step.
+        window : float
+            Maximum number of seconds the leader waits for the rest.
+        max_size : int, optional
+            Maximum number of items in a batch.
+        """
+        self.func = func
+        self.participants = participants
+        self.window = window
+        self.max_size = max_size
+        self._pending = {}
+        self._results = {}
+        self._served = set()
+        self._has_leader = False
+        self._deadline = None
+        self._cond = threading.Condition()
+        participants.register(self)
+
+    def submit(self, key, item):
+        """
+        Add an item to the current batch, and wait for its result.
+        Exceptions raised by func are raised to every HyperVisor in the batch.
+        """
+        with self._cond:
+            self._pending[key] = item
+            self._cond.notify_all()
+            if self._has_leader:
+                while key not in self._results:
+                    self._cond.wait()
+                return self._result(key)
+            self._has_leader = True
+            self._deadline = time.monotonic() + self.window
+            while not self._ready():
+                self._cond.wait(max(0, self._deadline - time.monotonic()))
+            batch = self._pending
+            self._pending = {}
+            self._served.update(batch)
+            self._has_leader = False
+        # let a new batch start while this one runs
+        try:
+            returned = self.func(batch)
+            results = {
+                k: (returned[k], False) if k in returned else (KeyError(f"no result for {k}"), True)
+                for k in batch
+            }
+        except Exception as ex:
+            results = {k: (ex, True) for k in batch}
+        with self._cond:
+            self._results.update(results)
+            self._cond.notify_all()
+            return self._result(key)
+
+    def skip(self, key):
+        """
+        Tell the collector this HyperVisor is not going to submit anything,
+        so the batch does not wait for it
+        """
+        with self._cond:
+            self._served.add(key)
+            self._cond.notify_all()
+
+    def wake_up(self):
+        """
+        Re-evaluate whether the current batch is ready
+        """
+        with self._cond:
+            self._cond.notify_all()
+
+    def _ready(self):
+        if self.max_size and len(self._pending) >= self.max_size:
+            return True
+        if time.monotonic() >= self._deadline:
+            return True
+        waiting_for = self.participants.snapshot() - self._served
+        return set(self._pending) >= waiting_for
+
+    def _result(self, key):
+        result, raised = self._results.pop(key)
+        if raised:
+            raise result
+        return result
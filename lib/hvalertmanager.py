@@ -1,7 +1,6 @@
-import json
-import requests
-import sys
 from lib.hvexception import HVException
+from lib.serviceclients import ALERTMANAGER_URL
+from lib.silencemanager import LABELS
 
 
 
@@ -15,9 +14,11 @@ class HVAlertManager:
         """
         self.creds_handler = hypervisormanager.creds_handler
         self.hostname = hypervisormanager.hostname
-        self.alertmanager_url = "https://openstack.stfc.ac.uk:9093"
+        self.alertmanager_url = ALERTMANAGER_URL
         self.time_interval = hypervisormanager.time_interval
         self.jira = hypervisormanager.jira
+        self.service_limits = hypervisormanager.service_limits
+        self.silence_manager = hypervisormanager.migration_manager.silence_manager
 
     def create_silence(self):
         """
@@ -34,67 +35,35 @@ class HVAlertManager:
 
     def _create_silence(self):
         """
-        Create silences for both ``hostname`` and ``instance`` labels.
+        Create silences for both ``hostname`` and ``instance`` labels,
+        unless the HyperVisor is already silenced, e.g. by the wave
+        silences or by a previous run of the step.
         """
-        silence_data_hostname = {
-            "matchers": [
-                {"name": "hostname",
-                 "value": self.hostname,
-                 "isRegex": False},
-            ],
-            "startsAt": self.time_interval.start_str,
-            "endsAt": self.time_interval.end_str, 
-            "createdBy": "admin",
-            "comment": f"RL9 Reinstall {self.time_interval.start_str} - {self.creds_handler.general.initials}"
-        }
-        silence_data_instance = {
-            "matchers": [
-                {"name": "instance",
-                 "value": self.hostname,
-                 "isRegex": False},
-            ],
-            "startsAt": self.time_interval.start_str,
-            "endsAt": self.time_interval.end_str, 
-            "createdBy": "admin",
-            "comment": f"RL9 Reinstall {self.time_interval.start_str} - {self.creds_handler.general.initials}"
-        }
-        response = self._create_silence_matcher(silence_data_hostname)
-        out_msg = f"Silence for hostname: {self.alertmanager_url}/#/silences/{response.json()['silenceID']}"
-        response = self._create_silence_matcher(silence_data_instance)
-        out_msg += "\n"
-        out_msg += f"Silence for instance: {self.alertmanager_url}/#/silences/{response.json()['silenceID']}"
-        msg = f"silence created in AlertManager successfully, from {self.time_interval.start_str} to {self.time_interval.end_str}"
-        msg += "\n"
-        msg += out_msg
-        self.jira.add(msg)
+        covering = self.silence_manager.covering(self.hostname)
+        created = {}
+        for label in LABELS:
+            if label not in covering:
+                created[label] = self.silence_manager.create(label, [self.hostname])
+        if created:
+            msg = f"silence created in AlertManager successfully, from {self.time_interval.start_str} to {self.time_interval.end_str}"
+            for label, silence_id in created.items():
+                msg += "\n"
+                msg += f"Silence for {label}: {self.silence_manager.url(silence_id)}"
+            self.jira.add(msg)
+        if covering:
+            msg = f"HyperVisor already silenced in AlertManager, at least until {self.time_interval.end_str}"
+            for label, silence_id in covering.items():
+                msg += "\n"
+                msg += f"Silence for {label}: {self.silence_manager.url(silence_id)}"
+            self.jira.add(msg)
         self.jira.send_buffer()
 
-
-    def _create_silence_matcher(self, silence_data):
+    def remove_silence(self):
         """
-        send a POST request to create a single Silence
+        Expire the silences for this HyperVisor.
+        Regex silences shared with other HyperVisors are narrowed instead.
         """
-        silences_endpoint = f"{self.alertmanager_url}/api/v2/silences"
-        # Make a POST request to the Alertmanager API with basic auth
-        headers = {"Content-Type": "application/json"}
-        from requests.auth import HTTPBasicAuth
-        basic = HTTPBasicAuth(self.creds_handler.alertmanager.username, self.creds_handler.alertmanager.password)
-        response = requests.post(silences_endpoint, auth=basic, json=silence_data, headers=headers)
-    
-        if response.status_code != 200:
-            msg = f"Failed to create silence. Response status code: {response.status_code}"
-            self.jira.add(msg)
-            text = f"Response text: {response.text}"
-            self.jira.add_block(response.text)
-            self.jira.send_buffer()
-            raise HVException(response.text)
-        else:
-            msg = f"Silence created successfully"
-            return response
-
-
-    def remove_silence(self):
-        raise NotImplementedError
-
-
-
+        messages = self.silence_manager.expire_silences([self.hostname])
+        msg = "\n".join(messages.get(self.hostname, ["No silence to expire in AlertManager"]))
+        self.jira.add(msg)
+        self.jira.send_buffer()
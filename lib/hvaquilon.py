@@ -1,6 +1,5 @@
-import paramiko
 from lib.hvexception import HVException
-from lib.hvlocal import Results
+from lib.aquilonsession import SCRIPTS_DIR
 
 class HVAquilon:
     def __init__(self, hypervisormanager):
@@ -13,16 +12,18 @@ class HVAquilon:
         self.creds_handler = hypervisormanager.creds_handler
         self.jira = hypervisormanager.jira
         self.hostname = hypervisormanager.hostname
-        self.client = paramiko.SSHClient()
-        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.aquilon_session = hypervisormanager.migration_manager.aquilon_session
 
     @property
     def model(self):
         """
         return the hardware model reported by Aquilon
         """
-        cmd = f'myaq-get-model {self.hostname}'
-        results = self.run(cmd)
+        if self.aquilon_session.worker:
+            results = self.run_action("get_model")
+        else:
+            cmd = f'myaq-get-model {self.hostname}'
+            results = self.run(cmd)
         return results.stdout
 
     def remove_interfaces(self):
@@ -30,9 +31,8 @@ class HVAquilon:
         remove interfaces other than bmc0 and eth0
         """
         self.jira.add("Removing unnecessary interfaces from the host on Aquilon")
-        cmd = f"python3 ./no_way_i_am_doing_this_manually/scripts/remove_interfaces.py {self.hostname}"
-        results = self.run(cmd)
-        self.jira.add(results.report_to_jira)
+        results = self.run_action("remove_interfaces")
+        self.jira.add_results(results)
         self.jira.send_buffer()
 
 
@@ -44,7 +44,7 @@ class HVAquilon:
         self.jira.add("Executing script to re-import the host on Aquilon")
         cmd = f"./no_way_i_am_doing_this_manually/scripts/reimport-host.sh {self.hostname}"
         results = self.run(cmd)
-        self.jira.add(results.report_to_jira)
+        self.jira.add_results(results)
         self.jira.send_buffer()
         
 
@@ -55,7 +55,7 @@ class HVAquilon:
         self.jira.add("Manage the host to David's Sandbox on Aquilon")
         cmd = f"python3 ./no_way_i_am_doing_this_manually/scripts/manage_hv_to_sandbox.py {self.hostname}"
         results = self.run(cmd)
-        self.jira.add(results.report_to_jira)
+        self.jira.add_results(results)
         self.jira.send_buffer()
 
 
@@ -67,13 +67,13 @@ class HVAquilon:
         self.jira.add("Checking if any SATA disk needs to be removed from aquilon")
         if "a100" in self.hostname:
             self.jira.add("HV hostname includes string a100, proceeding")
-            cmd = f'python3 ./no_way_i_am_doing_this_manually/scripts/remove_sata_disk.py {self.hostname}'
-            results = self.run(cmd)
-            self.jira.add(results.report_to_jira)
+            results = self.run_action("remove_sata_disk")
+            self.jira.add_results(results)
             self.jira.send_buffer()
         else:
             self.jira.add("HV hostname does not include string a100, nothing to do")
             self.jira.send_buffer()
+            self.skip_script("remove_sata_disk.py")
 
 
     def make_host(self):
@@ -81,9 +81,8 @@ class HVAquilon:
         recompile the host in aquilon
         """
         self.jira.add("Recompiling the HV on Aquilon")
-        cmd = f"python3 ./no_way_i_am_doing_this_manually/scripts/make_host.py {self.hostname}"
-        results = self.run(cmd)
-        self.jira.add(results.report_to_jira)
+        results = self.run_action("make_host")
+        self.jira.add_results(results)
         self.jira.send_buffer()
 
 
@@ -92,43 +91,89 @@ class HVAquilon:
         pxe switch the host in aquilon
         """
         self.jira.add("PXE-switching the HV on Aquilon")
-        cmd = f"python3 ./no_way_i_am_doing_this_manually/scripts/pxeswitch_host.py {self.hostname}"
-        results = self.run(cmd)
-        self.jira.add(results.report_to_jira)
+        results = self.run_action("pxeswitch_host")
+        self.jira.add_results(results)
         self.jira.send_buffer()
 
 
+    def run_action(self, action):
+        """
+        execute a myaq action for this HyperVisor on the Aquilon host,
+        in a resident myaq worker if enabled, otherwise with the helper
+        script of the same name
+        """
+        if not self.aquilon_session.worker:
+            return self.run_script(f"{action}.py")
+        try:
+            results, timing = self.aquilon_session.call(action, self.hostname)
+        except Exception as ex:
+            # e.g. the worker died, or answered something unexpected
+            self._report_exception(ex)
+        self.jira.add(f"Aquilon action {action} run by the myaq worker, {timing.report}")
+        self._check(results)
+        return results
+
+    def run_script(self, script):
+        """
+        execute one of the helper scripts for this HyperVisor on the Aquilon host.
+        In batch mode, the script runs once for all the HyperVisors ready
+        to run it at about the same time, and this one gets its own results.
+        """
+        if not self.aquilon_session.batch_window:
+            return self.run(f"python3 {SCRIPTS_DIR}/{script} {self.hostname}")
+        try:
+            results, timing = self.aquilon_session.batch(script).submit(self.hostname, None)
+        except Exception as ex:
+            # raised by the run of the whole batch
+            self._report_exception(ex)
+        self.jira.add(f"Aquilon command run for a batch of HyperVisors, {timing.report}")
+        self._check(results)
+        return results
+
+    def skip_script(self, script):
+        """
+        tell the batch of a helper script not to wait for this HyperVisor
+        """
+        if self.aquilon_session.batch_window and not self.aquilon_session.worker:
+            self.aquilon_session.batch(script).skip(self.hostname)
+
     def run(self, cmd):
         """
         execute any arbitrary command on the Aquilon host
         """
         results = self._run(cmd)
+        self._check(results)
+        return results
+
+    def _check(self, results):
+        """
+        report a failed command and raise an Exception
+        """
         if results.rc != 0:
             self.jira.add("Aquilon command failed")
             self.jira.add("Info from execution")
-            self.jira.add(results.report_to_jira)
+            self.jira.add_results(results)
             self.jira.add("raising Exception")
             self.jira.send_buffer()
             raise HVException("aquilon command failed")
-        return results
+
+    def _report_exception(self, ex):
+        """
+        Report an exception from the Aquilon session to Jira
+        and raise it again as an HVException
+        """
+        msg = f'Exception captured: {ex}'
+        self.jira.add("Exception captured")
+        self.jira.add_block(ex)
+        self.jira.send_buffer()
+        raise HVException(msg)
 
     def _run(self, cmd):
         """
-        do the actual execution of any arbitrary command on the Aquilon host
-        fix the environment first
-        """
-        self.client.connect(hostname="aquilon.gridpp.rl.ac.uk", username=self.creds_handler.aquilon.username, password=self.creds_handler.aquilon.password)
-        aqcmd = "export AQHOST=aquilon.gridpp.rl.ac.uk; export AQSERVICE=aqd;"
-        aqcmd += "export PATH=/opt/aquilon/bin/:$PATH;"
-        aqcmd += "export PATH=/var/quattor/bin/:$PATH;"
-        aqcmd += cmd
-        stdin, stdout, stderr = self.client.exec_command(aqcmd)
-        output = stdout.read().decode('utf-8').strip()
-        error = stderr.read().decode('utf-8').strip()
-        rc = stdout.channel.recv_exit_status()
-        self.client.close()
-        results = Results(cmd, output, error, rc)
+        do the actual execution of any arbitrary command on the Aquilon host,
+        through the session shared by all the HyperVisors
+        """
+        results, timing = self.aquilon_session.run(cmd)
+        # time waiting in the queue is time the broker was busy with other HyperVisors
+        self.jira.add(f"Aquilon command {timing.report}")
         return results
-
-
-
@@ -1,4 +1,24 @@
-import jira
+import gzip
+import itertools
+import time
+from dataclasses import dataclass
+from lib.serviceclients import JIRA_URL
+
+
+@dataclass
+class OutputLimits:
+    """
+    thresholds for reporting the output of commands to Jira
+
+    outputs (stdout and stderr together) up to inline_size characters
+    are added in full to the comment. Longer ones are summarized with
+    their first head_lines and last tail_lines lines, and the full
+    output is attached to the issue as a compressed file.
+    """
+    inline_size: int = 4000
+    head_lines: int = 20
+    tail_lines: int = 40
+
 
 class HVJira:
     def __init__(self, hypervisormanager):
@@ -14,11 +34,15 @@ class HVJira:
         """
         self.creds_handler = hypervisormanager.creds_handler
         self.issue_key = hypervisormanager.jira_issue_key
-        self.endpoint = "https://stfc.atlassian.net/"
-        self.username = self.creds_handler.jira.username
-        self.token = self.creds_handler.jira.api_token
-        self.conn = jira.client.JIRA(server=self.endpoint, basic_auth=(self.username, self.token))
-        self.buffer = "Message from automation library:\n"
+        self.service_limits = hypervisormanager.service_limits
+        self.endpoint = JIRA_URL
+        self.conn = hypervisormanager.service_clients.jira
+        self.sink = hypervisormanager.migration_manager.jira_sink
+        self.workflow = hypervisormanager.migration_manager.jira_workflow
+        self.output_limits = hypervisormanager.migration_manager.jira_output_limits
+        self.hostname = hypervisormanager.hostname
+        self.buffer = ""
+        self._attachment_counter = itertools.count(1)
 
     def add(self, text):
         """
@@ -46,12 +70,38 @@ class HVJira:
             "{code}"
         )
 
+    def add_results(self, results):
+        """
+        Append the results of a command to the internal Jira message buffer.
+        Large outputs are summarized, and attached in full as a compressed file.
+        Parameters
+        ----------
+        results : Results
+            Results of the command execution.
+        """
+        limits = self.output_limits
+        if results.size <= limits.inline_size:
+            self.add(results.report_to_jira)
+            return
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        filename = f"{self.hostname}-{timestamp}-{next(self._attachment_counter)}.txt.gz"
+        self.sink.attach(self.issue_key, filename, gzip.compress(results.full_text.encode()))
+        self.add(results.report_to_jira_summary(limits.head_lines, limits.tail_lines, filename))
+
     def send_buffer(self):
         """
-        Send the current buffer contents to Jira and reset it
+        Queue the current buffer contents to be sent to Jira and reset it.
+        Consecutive buffers are coalesced into a single comment by the sink.
+        """
+        if self.buffer:
+            self.sink.post(self.issue_key, self.buffer)
+        self.buffer = ""
+
+    def flush(self):
+        """
+        Send to Jira now everything queued for this issue
         """
-        self.conn.add_comment(self.issue_key, self.buffer, is_internal=True)
-        self.buffer = "Message from automation library:\n"
+        self.sink.flush(self.issue_key)
 
     # =========================================================================
     #       transitions
@@ -101,11 +151,9 @@ class HVJira:
         new_state : str
             Name of the target state as defined in Jira.
         """
-        allowed_transitions = self.conn.transitions(self.issue_key)
-        for transition in allowed_transitions:
-            # If we find the transition whose "to" state matches, perform the transition and return
-            if transition["to"]["name"] == new_state:
-                self.conn.transition_issue(self.issue_key, transition["id"])
-                break
+        # keep the comments before the transition in the issue history
+        self.flush()
+        # the transition id is looked up in the workflow cache shared by all issues
+        self.workflow.move(self.issue_key, new_state)
 
 
@@ -1,6 +1,6 @@
-import subprocess
 from lib.hvexception import HVException
-from lib.hvlocal import run
+from lib.kayobebatch import run_on_kayobe_host
+
 
 class HVKayobe:
     def __init__(self, hypervisormanager):
@@ -13,9 +13,11 @@ class HVKayobe:
         hypervisormanager : HyperVisorManager
             Manager instance providing credentials and Jira reporting.
         """
-        self.creds_handler = hypervisormanager.creds_handler
+        self.migration_manager = hypervisormanager.migration_manager
         self.jira = hypervisormanager.jira
         self.hostname = hypervisormanager.hostname
+        self.service_limits = hypervisormanager.service_limits
+        self.kayobe_batch = hypervisormanager.migration_manager.kayobe_batch
 
     def run_mellanox_playbook(self):
         """
@@ -23,8 +25,7 @@ class HVKayobe:
         """
         self.jira.add("Running the Mellanox playbook on the Kayobe host")
         self.jira.send_buffer()
-        cmd = f"~/no_way_i_am_doing_this_manually/scripts/mellanox_playbook.sh {self.hostname}"
-        self.run(cmd)
+        self.run_script("mellanox_playbook.sh")
 
     def run_cleanup_tmp(self):
         """
@@ -39,15 +40,7 @@ class HVKayobe:
         inventory information from netbox
         """
         self.jira.add("updating inventory from netbox on Kayobe host")
-        cmd = f"~/no_way_i_am_doing_this_manually/scripts/inventory_from_netbox.sh {self.hostname}"
-        results = self.run(cmd)
-        self.jira.add(results.report_to_jira)
-        if "fatal" in results.stdout:
-            self.jira.add("playbook failed, raising Exception")
-            self.jira.send_buffer()
-            raise HVException("playbook failed")
-        else:
-            self.jira.send_buffer()
+        self.run_script("inventory_from_netbox.sh")
 
     def run_kayobe_overcloud_host_configure(self):
         """
@@ -55,15 +48,7 @@ class HVKayobe:
         run the overcloud host configure playbooks
         """
         self.jira.add("executing kayobe overcloud host configure on Kayobe host")
-        cmd = f"~/no_way_i_am_doing_this_manually/scripts/kayobe_overcloud_host_configure.sh {self.hostname}"
-        results = self.run(cmd)
-        self.jira.add(results.report_to_jira)
-        if "fatal" in results.stdout:
-            self.jira.add("playbook failed, raising Exception")
-            self.jira.send_buffer()
-            raise HVException("playbook failed")
-        else:
-            self.jira.send_buffer()
+        self.run_script("kayobe_overcloud_host_configure.sh")
 
     def run_kayobe_overcloud_deploy_hypervisor(self):
         """
@@ -71,15 +56,7 @@ class HVKayobe:
         run the overcloud deploy hypervisor playbooks
         """
         self.jira.add("executing kayobe overcloud deploy hypervisor on Kayobe host")
-        cmd = f"~/no_way_i_am_doing_this_manually/scripts/kayobe_overcloud_deploy_hypervisor.sh {self.hostname}"
-        results = self.run(cmd)
-        self.jira.add(results.report_to_jira)
-        if "fatal" in results.stdout:
-            self.jira.add("playbook failed, raising Exception")
-            self.jira.send_buffer()
-            raise HVException("playbook failed")
-        else:
-            self.jira.send_buffer()
+        self.run_script("kayobe_overcloud_deploy_hypervisor.sh")
 
     def run_kayobe_overcloud_deploy_controller(self):
         """
@@ -87,16 +64,47 @@ class HVKayobe:
         run the overcloud deploy controller playbooks
         """
         self.jira.add("executing kayobe overcloud deploy controller on Kayobe host")
-        cmd = f"~/no_way_i_am_doing_this_manually/scripts/kayobe_overcloud_deploy_controller.sh {self.hostname}"
-        results = self.run(cmd)
-        self.jira.add(results.report_to_jira)
-        if "fatal" in results.stdout:
-            self.jira.add("playbook failed, raising Exception")
+        self.run_script("kayobe_overcloud_deploy_controller.sh")
+
+
+    def run_script(self, script):
+        """
+        execute one of the wrapper scripts for this HyperVisor on the Kayobe host.
+        The output of the playbook is parsed while it runs, and only
+        a summary (failures, PLAY RECAP, slowest tasks) is reported.
+        In batch mode, the script runs once for all the HyperVisors ready
+        to run it at about the same time, and this one gets its own slice
+        of the results.
+        """
+        try:
+            if self.kayobe_batch.window:
+                results = self.kayobe_batch.submit(script, self.hostname)
+            else:
+                results = self.kayobe_batch.run_script(script, [self.hostname])[self.hostname]
+            self.jira.add_results(results)
+            if results.rc != 0:
+                self.jira.add("playbook failed, raising Exception")
+                self.jira.send_buffer()
+                raise HVException("playbook failed")
             self.jira.send_buffer()
-            raise HVException("playbook failed")
-        else:
+            return results
+        except HVException as ex:
+            self.jira.add("The remote kayobe failed. Aborting.")
             self.jira.send_buffer()
+            raise ex
+        except Exception as ex:
+            # e.g. the SSH connection failed, or the run for the whole batch did
+            self.jira.add("Exception captured")
+            self.jira.add_block(ex)
+            self.jira.send_buffer()
+            raise HVException(f'Exception captured: {ex}')
 
+    def skip_script(self, script):
+        """
+        tell the batch of a wrapper script not to wait for this HyperVisor
+        """
+        if self.kayobe_batch.window:
+            self.kayobe_batch.skip(script, self.hostname)
 
     def run(self, cmd):
         """
@@ -104,13 +112,12 @@ class HVKayobe:
         and handle errors
         """
         try:
-            self._run(cmd)
+            return self._run(cmd)
         except HVException as ex:
             self.jira.add("The remote kayobe failed. Aborting.")
             self.jira.send_buffer()
             raise ex
         except Exception as ex:
-            msg = f'Exception captured: {ex}'
             self.jira.add("Exception captured")
             self.jira.add_block(ex)
             self.jira.send_buffer()
@@ -118,8 +125,8 @@ class HVKayobe:
 
     def _run(self, cmd):
         """
-        Run a command on the Kayobe host via SSH.
-        Ensure the SSH key are being propogated to the host.
+        Run a command on the Kayobe host via SSH,
+        and report the results
 
         Parameters
         ----------
@@ -128,17 +135,18 @@ class HVKayobe:
         Returns
         -------
         Results
-            Execution results from :func:`hvlocal.run`.
-        """
-        full_cmd = (
-            "eval $(ssh-agent) >/dev/null; "
-            f"ssh-add {self.creds_handler.kayobe.nopassfile} &>/dev/null; "
-            f"ssh -A {self.creds_handler.kayobe.username}@{self.creds_handler.kayobe.hostname} '{cmd}'"
-        )
-        results = run(full_cmd)
-        results.cmd = cmd # we remove local information from the cmd line, for security purposes
-        self.jira.add(results.report_to_jira)
+            Execution results from :func:`run_on_kayobe_host`.
+        """
+        with self.service_limits("kayobe"):
+            results = run_on_kayobe_host(self.migration_manager, cmd)
+        self._check(results)
+        return results
+
+    def _check(self, results):
+        """
+        report the results, and raise an Exception if the command failed
+        """
+        self.jira.add_results(results)
         self.jira.send_buffer()
         if results.rc != 0:
             raise HVException("kayobe command failed")
-
@@ -1,4 +1,12 @@
+import codecs
+import gzip
+import os
+import shutil
 import subprocess
+import tempfile
+import threading
+import time
+import zlib
 
 
 class Results:
@@ -22,11 +30,54 @@ class Results:
         self.stderr = stderr.strip()
         self.rc = rc
 
+    @property
+    def size(self):
+        """
+        Number of characters of stdout and stderr together
+        """
+        return len(self.stdout) + len(self.stderr)
+
+    @property
+    def full_text(self):
+        """
+        Format the execution results as plain text, e.g. for a log file
+        """
+        return (
+            f"command:\n{self.cmd}\n\n"
+            f"stdout:\n{self.stdout}\n\n"
+            f"stderr:\n{self.stderr}\n\n"
+            f"return code:\n{self.rc}\n"
+        )
+
     @property
     def report_to_jira(self):
         """
         Format the execution results as a Jira code block.
         """
+        return self._report(self.stdout, self.stderr)
+
+    def report_to_jira_summary(self, head_lines, tail_lines, attachment=None):
+        """
+        Format the execution results as a Jira code block, keeping only
+        the first and last lines of stdout and stderr.
+        Parameters
+        ----------
+        head_lines : int
+            Number of lines kept from the start of each output.
+        tail_lines : int
+            Number of lines kept from the end of each output.
+        attachment : str, optional
+            Name of the Jira attachment with the full output, to link to it.
+        """
+        stdout = _summarize(self.stdout, head_lines, tail_lines)
+        stderr = _summarize(self.stderr, head_lines, tail_lines)
+        msg = self._report(stdout, stderr)
+        if attachment:
+            msg += "\n"
+            msg += f"full output in attachment [^{attachment}]"
+        return msg
+
+    def _report(self, stdout, stderr):
         msg = "command:"
         msg += "\n"
         msg += (
@@ -39,7 +90,7 @@ class Results:
         msg += "\n"
         msg += (
             "{code}"
-            f'{self.stdout}'
+            f'{stdout}'
             "{code}"
         )
         msg += "\n"
@@ -47,7 +98,7 @@ class Results:
         msg += "\n"
         msg += (
             "{code}"
-            f'{self.stderr}'
+            f'{stderr}'
             "{code}"
         )
         msg += "\n"
@@ -61,6 +112,193 @@ class Results:
         return msg
 
 
+# longest line kept in a summarized output
+MAX_LINE_SIZE = 500
+
+
+def _summarize(text, head_lines, tail_lines):
+    """
+    Return the first and last lines of a text, with a note
+    about how many lines have been left out in between
+    """
+    lines = text.splitlines()
+    if len(lines) > head_lines + tail_lines:
+        omitted = len(lines) - head_lines - tail_lines
+        tail = lines[len(lines) - tail_lines:] if tail_lines else []
+        lines = lines[:head_lines] + [f"[... {omitted} lines omitted ...]"] + tail
+    lines = [
+        line if len(line) <= MAX_LINE_SIZE else line[:MAX_LINE_SIZE] + " [... line truncated ...]"
+        for line in lines
+    ]
+    return "\n".join(lines)
+
+
+# directory of the compressed logs with the outputs too long to keep in memory,
+# one file per host, e.g. outputs/hv01.nubes.rl.ac.uk.log.gz
+SPILL_DIR = "outputs"
+
+_spill_locks = {}
+_spill_locks_lock = threading.Lock()
+
+
+class SpilledText(str):
+    """
+    output too long to keep in memory: its value is only the first and
+    last parts of it, but `in` searches the full output, read back from
+    the compressed log it was spilled to
+    """
+    def __new__(cls, text, path, offset, length, size):
+        obj = super().__new__(cls, text)
+        obj.path = path
+        obj.offset = offset
+        obj.length = length
+        obj.size = size
+        return obj
+
+    def strip(self, chars=None):
+        return SpilledText(str.strip(self, chars), self.path, self.offset, self.length, self.size)
+
+    def __contains__(self, sub):
+        if str.__contains__(self, sub):
+            return True
+        overlap = ""
+        for chunk in self.iter_full():
+            text = overlap + chunk
+            if sub in text:
+                return True
+            overlap = text[len(text) - len(sub) + 1:] if len(sub) > 1 else ""
+        return False
+
+    def iter_full(self, chunk_size=65536):
+        """
+        Yield the full output, decompressed piece by piece
+        """
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            remaining = self.length
+            while remaining > 0:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield decoder.decode(decompressor.decompress(data))
+        yield decoder.decode(decompressor.flush(), final=True)
+
+    def full(self):
+        """
+        Return the full output, e.g. to parse it
+        """
+        return "".join(self.iter_full())
+
+
+def iter_lines(text):
+    """
+    Yield the lines of an output, reading a spilled one back from its log
+    """
+    if not isinstance(text, SpilledText):
+        yield from text.splitlines()
+        return
+    pending = ""
+    for chunk in text.iter_full():
+        lines = (pending + chunk).split("\n")
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+class OutputBuffer:
+    def __init__(self, limit, spill=None):
+        """
+        output of a command, keeping at most limit bytes in memory:
+        the first and the last halves, when it is too long
+
+        Parameters
+        ----------
+        limit : int
+            Maximum number of bytes kept in memory.
+        spill : str, optional
+            Name of the log (e.g. the hostname) where a longer output
+            is written in full, compressed, in SPILL_DIR.
+            Without it, the middle of a longer output is lost.
+        """
+        self.limit = limit
+        self.half = limit // 2
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.dropped = 0
+        self.size = 0
+        self.spill = spill
+        self._file = None
+        self._compressor = None
+        self._value = None
+
+    def write(self, data):
+        self.size += len(data)
+        if self._file is None and self.spill and self.size > self.limit:
+            # it will not fit, keep all of it on disk from now on
+            os.makedirs(SPILL_DIR, exist_ok=True)
+            self._file = tempfile.TemporaryFile(dir=SPILL_DIR)
+            self._compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+            self._file.write(self._compressor.compress(bytes(self.head + self.tail)))
+        if self._file is not None:
+            self._file.write(self._compressor.compress(data))
+        room = self.half - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        self.tail += data
+        if len(self.tail) > self.half:
+            excess = len(self.tail) - self.half
+            del self.tail[:excess]
+            self.dropped += excess
+
+    def getvalue(self, title=""):
+        """
+        Return the output, as a SpilledText if it was spilled
+        Parameters
+        ----------
+        title : str
+            Header of the output in the log, e.g. the command and stream.
+        """
+        if self._value is not None:
+            return self._value
+        text = self.head.decode("utf-8", "replace")
+        location = None
+        if self._file is not None:
+            location = self._save(title)
+            text += f"\n[... {self.dropped} bytes omitted, full output in {location[0]} ...]\n"
+        elif self.dropped:
+            text += f"\n[... {self.dropped} bytes omitted ...]\n"
+        text += self.tail.decode("utf-8", "replace")
+        self._value = SpilledText(text, *location, self.size) if location else text
+        return self._value
+
+    def _save(self, title):
+        """
+        Append the spilled output to the log of its host, after a header
+        Returns
+        -------
+        tuple(str, int, int)
+            Path of the log, and offset and length of the output in it.
+        """
+        self._file.write(self._compressor.flush())
+        path = os.path.join(SPILL_DIR, f"{self.spill}.log.gz")
+        with _spill_locks_lock:
+            lock = _spill_locks.setdefault(path, threading.Lock())
+        with lock, open(path, "ab") as log:
+            # a gzip file can be made of many members, zcat reads them all
+            log.write(gzip.compress(f"==== {time.strftime('%Y-%m-%d %H:%M:%S')} {title} ====\n".encode("utf-8")))
+            offset = log.tell()
+            self._file.seek(0)
+            shutil.copyfileobj(self._file, log)
+            length = log.tell() - offset
+        self._file.close()
+        return path, offset, length
+
+
 def run(cmd):
     """
     Run a shell command locally.
@@ -77,4 +315,3 @@ def run(cmd):
     (out, err) = subproc.communicate()
     rc = subproc.returncode
     return Results(cmd, out, err, rc)
-
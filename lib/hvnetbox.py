@@ -1,5 +1,6 @@
-import pynetbox
+from functools import cached_property
 from lib.hvexception import HVException
+from lib.serviceclients import NETBOX_URL
 
 
 
@@ -16,13 +17,18 @@ class HVNetbox:
         self.creds_handler = hypervisormanager.creds_handler
         self.hostname = hypervisormanager.hostname
         self.jira = hypervisormanager.jira
-        self.netbox_url = "https://netbox.esc.rl.ac.uk/"
-        self.conn = pynetbox.api(
-            self.netbox_url,
-            token = self.creds_handler.netbox.api_token
-        )
-        # Retrieve the device by name (returns None if not found)
-        self.device = self.conn.dcim.devices.get(name=self.hostname)
+        self.service_limits = hypervisormanager.service_limits
+        self.netbox_url = NETBOX_URL
+        self.conn = hypervisormanager.service_clients.netbox
+        self.inventory = hypervisormanager.migration_manager.netbox_inventory
+
+    @cached_property
+    def device(self):
+        """
+        Retrieve the device by name (returns None if not found)
+        from the devices prefetched for all the HyperVisors
+        """
+        return self.inventory.device(self.hostname)
 
 
     def hv_in_netbox(self):
@@ -77,6 +83,15 @@ class HVNetbox:
             self.jira.send_buffer()
             raise HVException(msg)
 
+    def queue_change(self, changes_d):
+        """
+        Queue one or more changes to the NetBox device entry.
+        They are applied in bulk, together with the ones for the other
+        HyperVisors, when the step finishes, and the outcome is reported then.
+        """
+        self.inventory.queue_change(self.hostname, changes_d, self.jira)
+        self.jira.add(f"changes {changes_d} to be applied in Netbox at the end of the step")
+
     def _change(self, changes_d):
         """
         Dispatch change operations based on the provided dictionary
@@ -91,13 +106,15 @@ class HVNetbox:
         """
         Change the device role in NetBox
         """
-        role = self.conn.dcim.device_roles.get(name=new_role)
+        role = self.inventory.role(new_role)
         if not role:
             return
+        device = self.device
         # Assign the retrieved role object
         ###self.device.device_role = role
-        self.device.role = role
-        self.device.save()
+        device.role = role
+        with self.service_limits("netbox"):
+            device.save()
         msg = f"Successfully updated role for device '{self.hostname}' to '{new_role}' in Netbox:"
         msg += "\n"
         msg += self.url
@@ -108,8 +125,10 @@ class HVNetbox:
         """
         Change the device status in NetBox
         """
-        self.device.status = new_status
-        self.device.save()
+        device = self.device
+        device.status = new_status
+        with self.service_limits("netbox"):
+            device.save()
         msg = f"Successfully updated status for device '{self.hostname}' to '{new_status}' in Netbox:"
         msg += "\n"
         msg += self.url
@@ -119,13 +138,10 @@ class HVNetbox:
     @property
     def ipmi_address(self):
         """
-        Return the IPMI address of the device
+        Return the IPMI address of the device,
+        resolved together with the ones for all the HyperVisors in the run
         """
-        interfaces = self.conn.dcim.interfaces.filter(device_id=self.device.id)
-        for i in interfaces:
-            if i.name == "bmc0":
-                ip_assignments = self.conn.ipam.ip_addresses.filter(interface_id=i.id)
-                return next(ip_assignments).address.split('/')[0]
+        return self.inventory.ipmi_address(self.hostname)
 
     @property
     def url(self):
@@ -148,6 +164,6 @@ class HVNetbox:
         check from the field Device type > Description 
         if the HV has GPUs
         """
-        description = self.device.device_type.description
+        description = self.inventory.device_type(self.device).description
         return "gpu" in description.lower()
 
@@ -1,32 +1,38 @@
 import openstack
-from datetime import datetime
-from lib.hvlocal import run
-import time
+from lib.hvexception import HVException
 
 
 class Server:
-    def __init__(self, hvopenstack, server_id):
+    def __init__(self, hvopenstack, server_id, server=None):
         """
         class to handle a single Server (VM)
         :param hvopenstack: a reference to the HVOpenstack instance that created this object
         :param server_id: the ID of the VM
+        :param server: the openstack.compute.v2.server.Server object, if already retrieved
         """
         self.hypervisormanager = hvopenstack.hypervisormanager
         self.creds_handler = self.hypervisormanager.creds_handler
         self.jira = self.hypervisormanager.jira
+        self.conn = hvopenstack.conn
         self.server_id = server_id
+        self.server = server
+        self.service_limits = self.hypervisormanager.service_limits
+
+    def refresh(self):
+        """
+        retrieve the current state of the server from the OpenStack API
+        """
+        with self.service_limits("openstack"):
+            self.server = self.conn.compute.get_server(self.server_id)
+        return self.server
 
     @property
     def status(self):
-        cmd = f'openstack --os-cloud {self.creds_handler.openstack.cloud} server show {self.server_id} -f value -c status'
-        results = run(cmd)
-        return results.stdout
+        return self.refresh().status
 
     @property
     def hypervisor(self):
-        cmd = f'openstack --os-cloud {self.creds_handler.openstack.cloud} server show {self.server_id} -f value -c "OS-EXT-SRV-ATTR:hypervisor_hostname"'
-        results = run(cmd)
-        return results.stdout
+        return self.refresh().hypervisor_hostname
 
 ###    def migrate(self):
 ###        """
@@ -76,7 +82,7 @@ class Server:
 class HVOpenstack:
     def __init__(self, hypervisormanager):
         """
-        Connect to OpenStack using credentials from ``hypervisormanager``.
+        Interact with OpenStack through the connection shared by all HyperVisors.
         Parameters
         ----------
         hypervisormanager : HyperVisorManager
@@ -87,16 +93,9 @@ class HVOpenstack:
         self.hostname = hypervisormanager.hostname
         self.time_interval = hypervisormanager.time_interval
         self.jira = hypervisormanager.jira
+        self.service_limits = hypervisormanager.service_limits
         self.binary_type = "nova-compute"
-        self.conn = openstack.connection.Connection(
-            auth_url = "https://openstack.stfc.ac.uk:5000/v3", 
-            project_name = "admin",  
-            username = self.creds_handler.openstack.username, 
-            password = self.creds_handler.openstack.password, 
-            user_domain_name = "default",
-            project_domain_name = "default", 
-            verify=True
-        )
+        self.conn = hypervisormanager.service_clients.openstack
 
     def ensure_hv_has_no_servers(self):
         """
@@ -108,61 +107,126 @@ class HVOpenstack:
     def disable_hv(self):
         """
         Disable the HyperVisor service in OpenStack
+
+        Returns
+        -------
+        openstack.compute.v2.service.Service
+            The nova-compute service after being disabled.
         """
-        cmd = f'openstack --os-cloud {self.creds_handler.openstack.cloud} compute service set --disable --disable-reason "Migration to Rocky 9 - {self.creds_handler.general.initials}" {self.hostname} nova-compute'
+        reason = f"Migration to Rocky 9 - {self.creds_handler.general.initials}"
         self.jira.add("disabling HV")
-        results = run(cmd)
-        self.jira.add(results.report_to_jira)
+        try:
+            service = self.compute_service
+            with self.service_limits("openstack"):
+                service = self.conn.compute.disable_service(service, disabled_reason=reason)
+        except openstack.exceptions.SDKException as ex:
+            self._report_exception(ex)
+        self.jira.add_block(self._format(service, self.service_fields))
         self.jira.send_buffer()
+        return service
     
     def enable_hv(self):
         """
         Re-enable the HyperVisor service in OpenStack
+
+        Returns
+        -------
+        openstack.compute.v2.service.Service
+            The nova-compute service after being enabled.
         """
-        cmd = f'openstack --os-cloud {self.creds_handler.openstack.cloud} compute service set --enable {self.hostname} nova-compute'
         self.jira.add("enabling HV")
-        results = run(cmd)
-        self.jira.add(results.report_to_jira)
+        try:
+            service = self.compute_service
+            with self.service_limits("openstack"):
+                service = self.conn.compute.enable_service(service)
+        except openstack.exceptions.SDKException as ex:
+            self._report_exception(ex)
+        self.jira.add_block(self._format(service, self.service_fields))
         self.jira.send_buffer()
+        return service
 
     def show_hv(self):
         """
         get the full status of the HyperVisor
+
+        Returns
+        -------
+        openstack.compute.v2.hypervisor.Hypervisor
         """
-        cmd = f'openstack --os-cloud {self.creds_handler.openstack.cloud} hypervisor show {self.hostname}'
         self.jira.add("full status of the HV")
-        results = run(cmd)
-        self.jira.add(results.report_to_jira)
+        try:
+            with self.service_limits("openstack"):
+                hypervisor = self.conn.compute.find_hypervisor(self.hostname, ignore_missing=False, details=True)
+        except openstack.exceptions.SDKException as ex:
+            self._report_exception(ex)
+        self.jira.add_block(self._format(hypervisor, self.hypervisor_fields))
         self.jira.send_buffer()
+        return hypervisor
 
     def list_servers(self):
         """
         if the HV is not empty, list the servers
+
+        Returns
+        -------
+        list of Server
         """
-        cmd = f"openstack --os-cloud {self.creds_handler.openstack.cloud} server list --host {self.hostname} --all-projects"
         self.jira.add("listing servers in HV")
-        results = run(cmd)
-        self.jira.add(results.report_to_jira)
+        try:
+            with self.service_limits("openstack"):
+                found = list(self.conn.compute.servers(all_projects=True, compute_host=self.hostname))
+        except openstack.exceptions.SDKException as ex:
+            self._report_exception(ex)
+        servers = [Server(self, server.id, server) for server in found]
+        self.jira.add(f"{len(servers)} servers found")
+        if servers:
+            self.jira.add_block(
+                "\n".join(self._format(server.server, self.server_fields, separator=" | ") for server in servers)
+            )
         self.jira.send_buffer()
-
-        # when not empty, output is like this
-        #  +--------------------------------------+-----------------+--------+--------------------------+-------+----------+----------------------------------+
-        #  | ID                                   | Name            | Status | Networks                 | Image | Flavor   | Project ID                       |
-        #  +--------------------------------------+-----------------+--------+--------------------------+-------+----------+----------------------------------+
-        #  | 1d8b1126-38e4-4758-9f6c-8d71f185f5a6 | ajh-test-001    | ACTIVE | internal-net=10.10.3.175 |       | c3.small | c9aee696c4b54f12a645af2c951327dc |
-        #  | 89a64bb3-5f44-4571-816a-7966ee9044ea | jake-hypervisor | ACTIVE | Internal=172.16.115.131  |       | c3.large | c9aee696c4b54f12a645af2c951327dc |
-        #  +--------------------------------------+-----------------+--------+--------------------------+-------+----------+----------------------------------+
-        
-        servers = []
-        out = results.stdout
-        if out:
-            lines = out.split('\n')
-            for line in lines[3:-1]:
-                fields = line.split('|')
-                server_id = fields[1].strip()
-                servers.append( Server(self, server_id) )
         return servers
 
+    # --------------------------------------------
+    #   auxiliary methods
+    # --------------------------------------------
+
+    service_fields = ["binary", "host", "status", "state", "disabled_reason", "updated_at"]
+    hypervisor_fields = ["name", "id", "status", "state", "hypervisor_type", "hypervisor_version",
+                         "host_ip", "running_vms", "vcpus", "vcpus_used", "memory_size", "memory_used",
+                         "local_disk_size", "local_disk_used"]
+    server_fields = ["id", "name", "status", "project_id"]
+
+    @property
+    def compute_service(self):
+        """
+        Return the nova-compute service running on the HyperVisor
+        """
+        with self.service_limits("openstack"):
+            services = list(self.conn.compute.services(host=self.hostname, binary=self.binary_type))
+        if not services:
+            msg = f"there is no {self.binary_type} service in OpenStack for host {self.hostname}"
+            self.jira.add(msg)
+            self.jira.send_buffer()
+            raise HVException(msg)
+        return services[0]
+
+    def _format(self, resource, fields, separator="\n"):
+        """
+        Render some fields of an OpenStack SDK resource as text for Jira
+        """
+        return separator.join(f"{field}: {getattr(resource, field, None)}" for field in fields)
+
+    def _report_exception(self, ex):
+        """
+        Report an exception from the OpenStack SDK to Jira
+        and raise it again as an HVException
+        """
+        msg = f'Exception captured: {ex}'
+        self.jira.add("Exception captured")
+        self.jira.add_block(ex)
+        self.jira.send_buffer()
+        raise HVException(msg)
+
 ###    def migrate_servers(self):
 ###        self.jira.add(f"migrating the servers in HV {self.hostname}")
 ###        self.jira.send_buffer()
@@ -1,10 +1,44 @@
 import paramiko
+import json
+from functools import cached_property
 import os
 import re
 from lib.hvexception import HVException
 from lib.hvlocal import Results
 
+
+# Probe shipped to the HyperVisor by HVSSH.collect_facts().
+# It runs every command in PROBES (prepended to the script when sent)
+# and prints a single JSON document with the results of all of them.
+_FACTS_SCRIPT = """
+import json
+import subprocess
+
+facts = {}
+for name, cmd in PROBES.items():
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    out, err = proc.communicate()
+    facts[name] = {"cmd": cmd, "stdout": out.strip(), "stderr": err.strip(), "rc": proc.returncode}
+print(json.dumps(facts))
+"""
+
+# Rocky 8 may not have python3 installed, but it always has platform-python
+_FACTS_INTERPRETER = "$(command -v python3 || echo /usr/libexec/platform-python) -"
+
+
 class HVSSH:
+    # commands whose output can be collected upfront in a single round trip
+    FACT_PROBES = {
+        "os_version": "cat /etc/os-release | grep VERSION_ID | awk -F= '{print $2}'",
+        "os_release": "cat /etc/os-release",
+        "virsh": "virsh list --all",
+        "lsblk": "lsblk",
+        "nvidia": "lspci | grep -i nvidia",
+        "mellanox": "lspci | grep -i mellanox",
+        "firmware": "ls /sys/firmware/",
+        "efi": "ls /sys/firmware/ | grep efi",
+    }
+
     def __init__(self, hypervisormanager):
         """
         Helper for executing commands on the HyperVisor via SSH
@@ -20,11 +54,52 @@ class HVSSH:
         self.ssh_public_key_path = self.ssh_private_key_path + '.pub'
         self.ssh_username = self.creds_handler.ssh.username
         self.ssh_passphrase = self.creds_handler.ssh.passphrase
+        self.hypervisormanager = hypervisormanager
         self.jira = hypervisormanager.jira
-        self.hvaquilon = hypervisormanager.hvaquilon
-        self.client = paramiko.SSHClient()
-        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.private_key = paramiko.RSAKey.from_private_key_file(self.ssh_private_key_path, password=self.ssh_passphrase)
+        self.ssh_pool = hypervisormanager.ssh_pool
+        self.facts = {}
+
+    @cached_property
+    def private_key(self):
+        """
+        Decrypt the SSH private key, only when a connection needs it
+        """
+        return paramiko.RSAKey.from_private_key_file(self.ssh_private_key_path, password=self.ssh_passphrase)
+
+    @property
+    def hvaquilon(self):
+        return self.hypervisormanager.hvaquilon
+
+    def collect_facts(self):
+        """
+        Run all the probes in FACT_PROBES on the HyperVisor in a single
+        round trip, and keep the results so the methods checking the OS
+        version, block devices, PCI cards, VMs and firmware read from them
+        instead of running their own remote command.
+        If the probe cannot run, those methods just run their commands.
+
+        Returns
+        -------
+        dict
+            Results of each probe, keyed by probe name.
+        """
+        script = f"PROBES = {self.FACT_PROBES!r}\n" + _FACTS_SCRIPT
+        results = self._run(_FACTS_INTERPRETER, "root", stdin_data=script)
+        try:
+            if results.rc != 0:
+                raise ValueError(results.stderr)
+            self.facts = json.loads(results.stdout)
+        except ValueError:
+            self.facts = {}
+            self.jira.add("Collecting the host facts in one go failed. Running each check separately.")
+            self.jira.add_results(results)
+        return self.facts
+
+    def clear_facts(self):
+        """
+        Forget the facts collected by collect_facts()
+        """
+        self.facts = {}
 
     def is_rocky_8(self):
         """
@@ -32,8 +107,8 @@ class HVSSH:
         Raise an Exception if that is not the case
         """
         self.jira.add("Checking the OS is Rocky 8")
-        results = self.run("cat /etc/os-release | grep VERSION_ID | awk -F= '{print $2}'", "root")
-        self.jira.add(results.report_to_jira)
+        results = self._probe("os_version")
+        self.jira.add_results(results)
         version = results.stdout[1:-1] # only the number embedded inside double quotes
         if version.startswith('8'):
             msg = f"the hypervisor {self.hostname} is Rocky 8. Ready to start."
@@ -51,8 +126,8 @@ class HVSSH:
         Raise an Exception if that is not the case
         """
         self.jira.add("Checking the OS is Rocky 9")
-        results = self.run("cat /etc/os-release | grep VERSION_ID | awk -F= '{print $2}'", "root")
-        self.jira.add(results.report_to_jira)
+        results = self._probe("os_version")
+        self.jira.add_results(results)
         version = results.stdout[1:-1] # only the number embedded inside double quotes
         if version.startswith('9'):
             msg = f"the hypervisor {self.hostname} is Rocky 9. Ready to continue."
@@ -71,9 +146,8 @@ class HVSSH:
         check if the current local account has root access to the HyperVisor
         """
         try:
-            self.client.connect(self.hostname, username="root", pkey=self.private_key, timeout=5)
-            self.client.exec_command("true")  # Simple command to confirm access
-            return True
+            results = self._run("true", "root")  # Simple command to confirm access
+            return results.rc == 0
         except Exception:
             return False
 
@@ -117,8 +191,8 @@ class HVSSH:
             If guests are present on the host.
         """
         self.jira.add("checking if HV is empty from within the host")
-        results = self.run("virsh list --all", "root")
-        self.jira.add(results.report_to_jira)
+        results = self._probe("virsh")
+        self.jira.add_results(results)
         out_l = results.stdout.split('\n')
         empty = (len(out_l) == 2)
         self.jira.add(f"is HV empty? {empty}")
@@ -129,13 +203,13 @@ class HVSSH:
             self.jira.send_buffer()
             raise HVException("hypervisor still not empty")
 
-    def virsh_info(self)
+    def virsh_info(self):
         """
         Log information about the number of running VMs
         """
         self.jira.add("checking the number of running VMs")
-        results = self.run("virsh list --all", "root")
-        self.jira.add(results.report_to_jira)
+        results = self._probe("virsh")
+        self.jira.add_results(results)
         self.jira.send_buffer()
 
     def blocks_info(self):
@@ -143,8 +217,8 @@ class HVSSH:
         Log information about block devices on the HyperVisor
         """
         self.jira.add("checking the block devices on the HV")
-        results = self.run("lsblk", "root")
-        self.jira.add(results.report_to_jira)
+        results = self._probe("lsblk")
+        self.jira.add_results(results)
         self.jira.send_buffer()
 
     def gpus_info(self):
@@ -152,8 +226,8 @@ class HVSSH:
         Log information about the detected NVIDIA GPUs on the HyperVisor
         """
         self.jira.add("checking the nvidia cards on the HV")
-        results = self.run("lspci | grep -i nvidia", "root")
-        self.jira.add(results.report_to_jira)
+        results = self._probe("nvidia")
+        self.jira.add_results(results)
         self.jira.send_buffer()
 
     def mellanox_info(self):
@@ -161,8 +235,8 @@ class HVSSH:
         return output from lspci for Mellanox devices
         """
         self.jira.add("checking the presence of mellanox cards on the HV")
-        results = self.run("lspci | grep -i mellanox", "root")
-        self.jira.add(results.report_to_jira)
+        results = self._probe("mellanox")
+        self.jira.add_results(results)
         self.jira.send_buffer()
         return results.stdout
     
@@ -172,8 +246,8 @@ class HVSSH:
         Raise an Exception when that is not the case
         """
         self.jira.add("checking if the HV is EFI")
-        results = self.run("ls /sys/firmware/ | grep efi", "root")
-        self.jira.add(results.report_to_jira)
+        results = self._probe("efi")
+        self.jira.add_results(results)
         if results.stdout != "":
             self.jira.add("the hypervisor is EFI enabled")
             self.jira.send_buffer()
@@ -204,7 +278,7 @@ class HVSSH:
         sudo -S su -c 'grep -qF "{public_key}" /root/.ssh/authorized_keys || echo "{public_key}" >> /root/.ssh/authorized_keys'
         """
         results = self.run(command)
-        self.jira.add(results.report_to_jira)
+        self.jira.add_results(results)
         msg = f"user {self.ssh_username} now has root access to hypervisor {self.hostname}"
         self.jira.add(msg)
         self.jira.send_buffer()
@@ -215,11 +289,11 @@ class HVSSH:
         """
         self.jira.add("updating qemu")
         results = self.run('dnf -y update qemu-kvm', 'root')
-        self.jira.add(results.report_to_jira)
+        self.jira.add_results(results)
         if results.rc != 0:
             self.jira.add("command failed. Checking the content of file /etc/resolv.conf")
             results_resolv = self.run('cat /etc/resolv.conf', 'root')
-            self.jira.add(results_resolv.report_to_jira) 
+            self.jira.add_results(results_resolv)
         self.jira.send_buffer()
         if results.rc != 0:
             raise HVException("updating qemu failed")
@@ -235,37 +309,37 @@ class HVSSH:
     def _hardware_fix_2022_lenovo(self):
         self.jira.add("Performing hardware specific fixes for 2022 Lenovo HyperVisors")
         self.run('mkfs.xfs /dev/nvme0n1 -f', 'root')
-        self.jira.add(results.report_to_jira)
+        self.jira.add_results(results)
         self.run('echo "/dev/nvme0n1 /var/lib/nova/instances xfs rw,relatime,attr2,inode64,logbufs=8,logbsize=32k,noquota" >> /etc/fstab', 'root')
-        self.jira.add(results.report_to_jira)
+        self.jira.add_results(results)
         self.run('mkdir -p /var/lib/nova/instances', 'root')
-        self.jira.add(results.report_to_jira)
+        self.jira.add_results(results)
         self.run('mount -a', 'root')
         results = self.run('lsblk', 'root')
-        self.jira.add(results.report_to_jira)
+        self.jira.add_results(results)
         if "/var/lib/nova/instances" not in results.stdout:
             self.jira.add("New mount did not work as expected. Aborting")
             self.jira.add_block(results.stdout)
             self.jira.send_buffer()
             raise HVException("New mount did not work as expected. Aborting")
         self.run('systemctl daemon-reload', 'root')
-        self.jira.add(results.report_to_jira)
+        self.jira.add_results(results)
         self.jira.send_buffer()
 
     def _hardware_fix_xma_hv_2022_a100(self):
         self.jira.add("Performing hardware specific fixes for 2022 XMA A100 HyperVisors")
         sel.run('mdadm --zero-superblock /dev/nvme0n1', 'root')
-        self.jira.add(results.report_to_jira)
+        self.jira.add_results(results)
         sel.run('sgdisk -n 1:0:0 /dev/nvme0n1', 'root')
-        self.jira.add(results.report_to_jira)
+        self.jira.add_results(results)
         sel.run('sgdisk -t 1:fd00 /dev/nvme0n1', 'root')
-        self.jira.add(results.report_to_jira)
+        self.jira.add_results(results)
         sel.run('mdadm --create --verbose /dev/md0 --level=0 --raid-devices=2 /dev/nvme0n1p1 /dev/nvme1n1p1', 'root')
-        self.jira.add(results.report_to_jira)
+        self.jira.add_results(results)
         sel.run('mkfs.xfs /dev/md0', 'root')
-        self.jira.add(results.report_to_jira)
+        self.jira.add_results(results)
         sel.run('mdadm --detail --scan >> /etc/mdadm.conf', 'root')
-        self.jira.add(results.report_to_jira)
+        self.jira.add_results(results)
         self.jira.send_buffer()
         
 
@@ -273,27 +347,40 @@ class HVSSH:
     #   Generic execution methods
     # --------------------------------------------
 
-    def run(self, cmd, username=None):
-        results = self._run(cmd, username)
+    def run(self, cmd, username=None, stdin_data=None):
+        results = self._run(cmd, username, stdin_data)
+        return self._check(results)
+
+    def _probe(self, name):
+        """
+        Return the results of one of the FACT_PROBES commands, from the
+        collected facts if available, or running it as root otherwise
+        """
+        fact = self.facts.get(name)
+        if fact is None:
+            return self.run(self.FACT_PROBES[name], "root")
+        results = Results(fact["cmd"], fact["stdout"], fact["stderr"], fact["rc"])
+        return self._check(results)
+
+    def _check(self, results):
+        """
+        Report and raise an Exception if the remote command failed
+        """
         if results.rc != 0:
             self.jira.add("Remote command failed")
             self.jira.add("Info from execution")
-            self.jira.add(results.report_to_jira)
+            self.jira.add_results(results)
             self.jira.add("raising Exception")
             self.jira.send_buffer()
             raise HVException("Remote command failed")
         return results
 
-    def _run(self, cmd, username=None):
+    def _run(self, cmd, username=None, stdin_data=None):
         if not username:
             # if not username is passed, e.g. "root", 
             # we SSH as the regular user set in creds.yaml
             username = self.creds_handler.ssh.username
-        self.client.connect(hostname=self.hostname, port=22, username=username, pkey=self.private_key)
-        stdin, stdout, stderr = self.client.exec_command(cmd)
-        output = stdout.read().decode('utf-8').strip()
-        error = stderr.read().decode('utf-8').strip()
-        rc = stdout.channel.recv_exit_status()
-        self.client.close()
-        results = Results(cmd, output, error, rc)
+        # the connection is kept open in the pool and reused by the
+        # following commands, each one running on its own channel
+        results = self.ssh_pool.exec_command(self.hostname, username, cmd, pkey=self.private_key, stdin_data=stdin_data)
         return results
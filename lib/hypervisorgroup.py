@@ -1,38 +1,114 @@
-import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+
+@dataclass
+class StepResult:
+    """
+    outcome of running a step for a single HyperVisor
+
+    status is one of
+        - "ok": the step completed
+        - "aborted": the step raised an HVException, or its NetBox changes
+          could not be applied, already reported to Jira
+        - "error": the step raised an unexpected Exception
+    """
+    hostname: str
+    jira_issue_key: str
+    status: str
+    elapsed: float
+    exception: Exception = field(default=None)
+
 
 class HyperVisorGroup(list):
 
-    def __init__(self, migration_manager):
+    def __init__(self, migration_manager, max_workers=None):
         self.migration_manager = migration_manager
+        self.max_workers = max_workers
         super(HyperVisorGroup, self).__init__()
 
     def run(self, step):
         if step == "setup":
-            self._run_parallel(step)
+            return self._run_parallel(step)
         elif step == "pre_drain":
-            self._run_parallel(step)
+            return self._run_parallel(step)
         elif step == "pre_reinstall":
-            self._run_parallel(step)
+            return self._run_parallel(step)
         elif step == "post_reinstall":
-            self._run_parallel(step)
+            return self._run_parallel(step)
         elif step == "noops":
-            self._run_parallel(step)
+            return self._run_parallel(step)
 
     def _run_series(self, step):
         """
         process each HyperVisor in series for a given step
         """
-        for hv in self.__iter__():
-            getattr(hv, step)()
+        results = [self._run_one(hv, step) for hv in self.__iter__()]
+        self._apply_changes(results)
+        self._print_summary(step, results)
+        return results
 
     def _run_parallel(self, step):
         """
-        process all HyperVisors in parallel for a given step
+        process all HyperVisors in parallel for a given step,
+        with at most max_workers of them at the same time
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=step) as executor:
+            futures = [executor.submit(self._run_one, hv, step) for hv in self.__iter__()]
+            results = [future.result() for future in futures]
+        self._apply_changes(results)
+        self._print_summary(step, results)
+        return results
+
+    def _run_one(self, hv, step):
+        """
+        run the step for a single HyperVisor and record the outcome
+        """
+        start = time.monotonic()
+        try:
+            # while active, batches of requests from many HyperVisors may wait for it
+            with self.migration_manager.participants.active(hv.hostname):
+                completed = getattr(hv, step)()
+            status = "aborted" if completed is False else "ok"
+            exception = None
+        except Exception as ex:
+            print(f"Unexpected ERROR for hypervisor {hv.hostname}:")
+            traceback.print_exc()
+            status = "error"
+            exception = ex
+        finally:
+            # the step is over for this HyperVisor, do not wait for the
+            # rest of them to post its comments
+            hv.flush()
+        elapsed = time.monotonic() - start
+        return StepResult(hv.hostname, hv.jira_issue_key, status, elapsed, exception)
+
+    def _apply_changes(self, results):
+        """
+        apply the NetBox changes queued by the HyperVisors during the step,
+        in bulk, and mark as aborted those whose changes failed
+        (already reported to Jira)
+        """
+        outcomes = self.migration_manager.netbox_inventory.apply_changes()
+        for result in results:
+            exception = outcomes.get(result.hostname)
+            if exception is not None and result.status == "ok":
+                result.status = "aborted"
+                result.exception = exception
+
+    def _print_summary(self, step, results):
+        """
+        print one line per HyperVisor with the outcome of the step
         """
-        threads = []
-        for hv in self.__iter__():
-            thread = threading.Thread(target=getattr(hv, step))
-            threads.append(thread)
-            thread.start()
-        for thread in threads:
-            thread.join()
+        print()
+        print(f"Summary for step {step}:")
+        for result in results:
+            line = f"  {result.hostname} {result.jira_issue_key}: {result.status} ({result.elapsed:.1f}s)"
+            if result.exception is not None:
+                line += f" {result.exception!r}"
+            print(line)
+        for status in ["ok", "aborted", "error"]:
+            count = len([result for result in results if result.status == status])
+            print(f"  {status}: {count}")
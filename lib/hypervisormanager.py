@@ -1,3 +1,4 @@
+from functools import cached_property
 from lib.hvalertmanager import HVAlertManager
 from lib.hvnetbox import HVNetbox
 from lib.hvopenstack import HVOpenstack
@@ -12,31 +13,67 @@ class HyperVisorManager:
         """
         High level orchestration for HyperVisor migration steps
         Coordinate the various services used to migrate a HyperVisor
-        Initialise and create helpers for the target HyperVisor
+        The helpers for the target HyperVisor are created the first time
+        they are used, so each step only pays for the services it needs
         """
         self.migration_manager = migration_manager
         self.hostname = hostname
         self.jira_issue_key = jira_issue_key
         self.creds_handler = migration_manager.credentials_handler
         self.time_interval = migration_manager.time_interval
-        self.jira = HVJira(self)
-        self.hvalertmanager = HVAlertManager(self)
-        self.hvnetbox = HVNetbox(self)
-        self.hvopenstack = HVOpenstack(self)
-        self.hvaquilon = HVAquilon(self)
-        self.hvssh = HVSSH(self)
-        self.hvkayobe = HVKayobe(self)
+        self.ssh_pool = migration_manager.ssh_pool
+        self.service_limits = migration_manager.service_limits
+        self.service_clients = migration_manager.service_clients
 
+    @cached_property
+    def jira(self):
+        return HVJira(self)
+
+    @cached_property
+    def hvalertmanager(self):
+        return HVAlertManager(self)
+
+    @cached_property
+    def hvnetbox(self):
+        return HVNetbox(self)
+
+    @cached_property
+    def hvopenstack(self):
+        return HVOpenstack(self)
+
+    @cached_property
+    def hvaquilon(self):
+        return HVAquilon(self)
+
+    @cached_property
+    def hvssh(self):
+        return HVSSH(self)
+
+    @cached_property
+    def hvkayobe(self):
+        return HVKayobe(self)
+
+
+    def flush(self):
+        """
+        Send to Jira the comments still queued for this HyperVisor,
+        if the Jira helper has been used at all
+        """
+        if "jira" in self.__dict__:
+            self.jira.flush()
 
     def setup(self):
         try:
             self.hvssh.ensure_root_access()
+            return True
         except HVException as ex:
             msg = f"An ERROR occurred {ex}. Aborting automation for hypervisor {self.hostname}"
             print(msg)
+            return False
 
     def pre_drain(self):
         try:
+            self.hvssh.collect_facts()
             self.hvssh.is_rocky_8()
             self.hvssh.update_qemu_kvm()
             self.hvnetbox.hv_in_netbox()
@@ -44,62 +81,79 @@ class HyperVisorManager:
             self.hvopenstack.disable_hv()
             self.hvopenstack.show_hv()
             self.hvssh.virsh_info()
+            return True
         except HVException as ex:
             msg = f"An ERROR occurred {ex}. Aborting automation for hypervisor {self.hostname}"
             print(msg)
             self.jira.add(msg)
             self.jira.send_buffer()
             self.jira.move_to_pre_reinstall_failed()
+            return False
+        finally:
+            self.hvssh.clear_facts()
 
 
     def pre_reinstall(self):
         try:
             #self.jira.move_to_working_on_pre_bios()
             self.hvopenstack.ensure_hv_has_no_servers()
+            self.hvssh.collect_facts()
             self.hvssh.is_empty()
             self.hvssh.blocks_info()
             if self.hvnetbox.has_gpu:
                 self.hvssh.gpus_info()
             self.hvalertmanager.create_silence()
             self.hvnetbox.change({"status":"planned"})
-            self.hvssh.mellanox_info()
+            mellanox = self.hvssh.mellanox_info()
             self.hvaquilon.reimport()
             self.hvaquilon.remove_interfaces()
             self.hvaquilon.remove_sata_disk()
             self.hvaquilon.make_host()
             self.hvaquilon.pxeswitch_host()
-            if self.hvssh.mellanox_info() != "":
+            if mellanox != "":
                 self.hvkayobe.run_mellanox_playbook()
+            else:
+                self.hvkayobe.skip_script("mellanox_playbook.sh")
             self.hvnetbox.report_ipmi_address()
             #self.jira.move_to_ready_for_reinstall()
+            return True
         except HVException as ex:
             msg = f"An ERROR occurred {ex}. Aborting automation for hypervisor {self.hostname}"
             print(msg)
             self.jira.add(msg)
             self.jira.send_buffer()
             self.jira.move_to_pre_bios_failed()
+            return False
+        finally:
+            self.hvssh.clear_facts()
 
     def post_reinstall(self):
         try:
             #self.jira.move_to_working_on_post_reinstall()
+            self.hvssh.collect_facts()
             self.hvssh.is_rocky_9()
             self.hvssh.blocks_info()
             if self.hvnetbox.has_gpu:
                 self.hvssh.gpus_info()
             self.hvssh.verify_is_efi()
             self.hvssh.hardware_specific()
-            self.hvnetbox.change({"status":"active", "role":"Openstack Prod Kolla_Compute"})
+            self.hvnetbox.queue_change({"status":"active", "role":"Openstack Prod Kolla_Compute"})
             #self.jira.move_to_ready_for_adoption()
+            return True
         except HVException as ex:
             msg = f"An ERROR occurred {ex}. Aborting automation for hypervisor {self.hostname}"
             print(msg)
             self.jira.add(msg)
             self.jira.send_buffer()
+            return False
+        finally:
+            self.hvssh.clear_facts()
 
 
     def noops(self):
         """
-        do nothing, just to test all objects are created properly
+        do nothing, just to test the list of HyperVisors is parsed properly
         """
         print(self.hostname)
+        return True
 
@@ -0,0 +1,222 @@
+import io
+import os
+import threading
+import time
+from lib.hvlocal import SPILL_DIR
+
+
+HEADER = "Message from automation library:\n"
+
+# Jira rejects comments longer than 32767 characters
+MAX_COMMENT_SIZE = 32000
+
+
+class JiraCommentSink:
+    def __init__(self, service_clients, service_limits, rate_limiter, flush_interval=60, flush_size=16000):
+        """
+        Buffered writer of Jira comments, shared by all the HyperVisors
+
+        Texts posted for an issue are coalesced into a single comment,
+        which is sent by a background thread when one of these happens:
+            - the pending text for the issue exceeds flush_size characters
+            - the oldest pending text for the issue is flush_interval seconds old
+            - flush() is called, e.g. at the end of the step or before a
+              transition of the issue
+        so the threads doing the actual work never wait for Jira to post
+        each comment.
+        Files attached to an issue are queued the same way, and are always
+        uploaded before the comments queued with them, so the comments can
+        link to them.
+
+        Parameters
+        ----------
+        service_clients : ServiceClients
+            Registry providing the shared Jira client.
+        service_limits : ServiceLimits
+            Concurrency caps for the calls to Jira.
+        rate_limiter : RateLimiter
+            Rate limiter shared by all the calls to Jira.
+        flush_interval : int
+            Maximum number of seconds a text is kept before being sent.
+        flush_size : int
+            Number of pending characters for an issue that triggers sending them.
+        """
+        self.service_clients = service_clients
+        self.service_limits = service_limits
+        self.rate_limiter = rate_limiter
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._pending = {}
+        self._attachments = {}
+        self._since = {}
+        self._urgent = set()
+        self._issue_locks = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._writer, name="jira-sink", daemon=True)
+        self._thread.start()
+
+    def post(self, issue_key, text):
+        """
+        Queue a text to be added as an internal comment to an issue
+        """
+        with self._cond:
+            texts = self._pending.setdefault(issue_key, [])
+            texts.append(text)
+            self._since.setdefault(issue_key, time.monotonic())
+            if sum(len(t) for t in texts) >= self.flush_size:
+                self._urgent.add(issue_key)
+                self._cond.notify()
+
+    def attach(self, issue_key, filename, data):
+        """
+        Queue a file to be attached to an issue
+        Parameters
+        ----------
+        issue_key : str
+            Key of the issue.
+        filename : str
+            Name of the attachment in Jira.
+        data : bytes
+            Content of the file.
+        """
+        with self._cond:
+            self._attachments.setdefault(issue_key, []).append((filename, data))
+            self._since.setdefault(issue_key, time.monotonic())
+
+    def flush(self, issue_key):
+        """
+        Send now, from the calling thread, all pending attachments
+        and text for an issue
+        """
+        with self._issue_lock(issue_key):
+            attachments, texts = self._take(issue_key)
+            for filename, data in attachments:
+                self._upload(issue_key, filename, data)
+            self._send(issue_key, texts)
+
+    def flush_all(self):
+        """
+        Send now all pending text for all issues
+        """
+        with self._cond:
+            issue_keys = set(self._pending) | set(self._attachments)
+        for issue_key in issue_keys:
+            self.flush(issue_key)
+
+    def close(self):
+        """
+        Send all pending text and stop the background thread
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush_all()
+
+    def _issue_lock(self, issue_key):
+        """
+        Return the lock that keeps the comments for an issue in order
+        """
+        with self._cond:
+            return self._issue_locks.setdefault(issue_key, threading.Lock())
+
+    def _take(self, issue_key):
+        """
+        Remove and return the pending attachments and texts for an issue
+        """
+        with self._cond:
+            self._since.pop(issue_key, None)
+            self._urgent.discard(issue_key)
+            return self._attachments.pop(issue_key, []), self._pending.pop(issue_key, [])
+
+    def _due(self):
+        """
+        Return the issues whose pending text must be sent now,
+        and the number of seconds until the next one is due
+        """
+        now = time.monotonic()
+        due = set(self._urgent)
+        timeout = self.flush_interval
+        for issue_key, since in self._since.items():
+            age = now - since
+            if age >= self.flush_interval:
+                due.add(issue_key)
+            else:
+                timeout = min(timeout, self.flush_interval - age)
+        return due, timeout
+
+    def _writer(self):
+        """
+        Body of the background thread
+        """
+        while True:
+            with self._cond:
+                due, timeout = self._due()
+                if not due and not self._closed:
+                    self._cond.wait(timeout)
+                    due, timeout = self._due()
+                if self._closed:
+                    return
+            for issue_key in due:
+                try:
+                    self.flush(issue_key)
+                except Exception as ex:
+                    # keep sending the comments for the other issues
+                    print(f"Failed to send the pending comments for Jira issue {issue_key}: {ex}")
+
+    def _send(self, issue_key, texts):
+        """
+        Post the texts as one comment, or as a few if they are too long
+        """
+        for body in self._comments(texts):
+            try:
+                with self.service_limits("jira"):
+                    self.rate_limiter.call(self.service_clients.jira.add_comment, issue_key, HEADER + body, is_internal=True)
+            except Exception as ex:
+                # do not lose the information, at least leave it in the logs
+                print(f"Failed to add comment to Jira issue {issue_key}: {ex}")
+                print(body)
+
+    def _upload(self, issue_key, filename, data):
+        """
+        Attach a file to an issue, in a single request
+        """
+        def add_attachment():
+            # a new file object for each attempt, as a failed one may have read it
+            return self.service_clients.jira.add_attachment(issue_key, attachment=io.BytesIO(data), filename=filename)
+        try:
+            with self.service_limits("jira"):
+                self.rate_limiter.call(add_attachment)
+        except Exception as ex:
+            # do not lose the information, at least keep the file locally
+            print(f"Failed to attach {filename} to Jira issue {issue_key}: {ex}")
+            path = os.path.join(SPILL_DIR, f"{issue_key}-{filename}")
+            try:
+                os.makedirs(SPILL_DIR, exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(data)
+            except Exception as ex:
+                print(f"Failed to keep {filename} locally as {os.path.abspath(path)}: {ex}")
+                return
+            print(f"Kept it as {os.path.abspath(path)}")
+
+    def _comments(self, texts):
+        """
+        Join the texts into as few comments as possible, each one
+        within the maximum size allowed by Jira
+        """
+        comment = ""
+        for text in texts:
+            while len(text) > MAX_COMMENT_SIZE:
+                if comment:
+                    yield comment
+                    comment = ""
+                yield text[:MAX_COMMENT_SIZE]
+                text = text[MAX_COMMENT_SIZE:]
+            if comment and len(comment) + len(text) + 1 > MAX_COMMENT_SIZE:
+                yield comment
+                comment = ""
+            comment = f"{comment}\n{text}" if comment else text
+        if comment:
+            yield comment
@@ -0,0 +1,166 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from jira.exceptions import JIRAError
+
+
+class JiraWorkflow:
+    def __init__(self, migration_manager, issue_keys, chunk_size=100):
+        """
+        Cache of the Jira workflow, shared by all the HyperVisors
+
+        All the "HyperVisor" issues share the same workflow, so the id
+        of the transition from one status to another is the same for all
+        of them. The transitions are only requested to Jira the first time
+        an issue leaves a given status, and the current status of all the
+        issues in the run is fetched with a single search, and then kept
+        up to date as the issues are moved.
+
+        Parameters
+        ----------
+        migration_manager : MigrationManager
+            Manager providing the shared Jira client, limits and rate limiter.
+        issue_keys : list of str
+            Keys of all the issues in the run.
+        chunk_size : int
+            Maximum number of issue keys in a single search.
+        """
+        self.service_clients = migration_manager.service_clients
+        self.service_limits = migration_manager.service_limits
+        self.rate_limiter = migration_manager.jira_rate_limiter
+        self.issue_keys = list(issue_keys)
+        self.chunk_size = chunk_size
+        self._transitions = {}
+        self._known_statuses = set()
+        self._statuses = None
+        self._lock = threading.Lock()
+        # held while loading the statuses, so they are only searched once
+        self._load_lock = threading.Lock()
+
+    @property
+    def conn(self):
+        return self.service_clients.jira
+
+    def move(self, issue_key, new_state):
+        """
+        Transition an issue to a new state
+
+        Parameters
+        ----------
+        issue_key : str
+            Key of the issue to move.
+        new_state : str
+            Name of the target state as defined in Jira.
+        Returns
+        -------
+        bool
+            True if the issue was moved, or was already in that state.
+            False if there is no transition to that state from the current one.
+        """
+        for attempt in [1, 2]:
+            current = self.status(issue_key)
+            if current == new_state:
+                return True
+            transition_id = self._transition_id(issue_key, current, new_state)
+            if transition_id is not None:
+                try:
+                    self._call(self.conn.transition_issue, issue_key, transition_id)
+                    with self._lock:
+                        self._statuses[issue_key] = new_state
+                    return True
+                except JIRAError:
+                    if attempt == 2:
+                        raise
+            # the issue may have been moved by someone else, or the workflow
+            # may have changed. Forget what we know and try once more.
+            self._forget(issue_key, current)
+        return False
+
+    def move_issues(self, issue_keys, new_state, max_workers=8):
+        """
+        Transition many issues to the same state concurrently
+
+        Returns
+        -------
+        dict
+            For each issue key, the value returned by move(),
+            or the Exception raised.
+        """
+        def move_one(issue_key):
+            try:
+                return self.move(issue_key, new_state)
+            except Exception as ex:
+                return ex
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(issue_keys, executor.map(move_one, issue_keys)))
+
+    def status(self, issue_key):
+        """
+        Return the name of the current status of an issue
+        """
+        with self._load_lock:
+            if self._statuses is None:
+                statuses = self._load_statuses()
+                with self._lock:
+                    self._statuses = statuses
+        with self._lock:
+            if issue_key in self._statuses:
+                return self._statuses[issue_key]
+        # ask Jira without holding the lock, which may take a while when throttled
+        issue = self._call(self.conn.issue, issue_key, fields="status")
+        with self._lock:
+            self._statuses[issue_key] = issue.fields.status.name
+            return self._statuses[issue_key]
+
+    def _transition_id(self, issue_key, current, new_state):
+        """
+        Return the id of the transition from the current status to the new one,
+        asking Jira only if it is not known yet
+        """
+        with self._lock:
+            if current in self._known_statuses:
+                return self._transitions.get((current, new_state))
+        transitions = self._call(self.conn.transitions, issue_key)
+        with self._lock:
+            for transition in transitions:
+                self._transitions[(current, transition["to"]["name"])] = transition["id"]
+            self._known_statuses.add(current)
+            return self._transitions.get((current, new_state))
+
+    def _forget(self, issue_key, status):
+        """
+        Drop the cached status of an issue and the cached transitions from a status
+        """
+        with self._lock:
+            self._statuses.pop(issue_key, None)
+            self._known_statuses.discard(status)
+            for key in [key for key in self._transitions if key[0] == status]:
+                del self._transitions[key]
+
+    def _load_statuses(self):
+        """
+        Fetch the current status of all the issues in the run.
+        If the search for a chunk fails, e.g. because one of its keys
+        does not exist anymore, its issues are fetched one by one, and
+        the ones that cannot be fetched are left out.
+        """
+        statuses = {}
+        for i in range(0, len(self.issue_keys), self.chunk_size):
+            chunk = self.issue_keys[i:i + self.chunk_size]
+            jql = f"key in ({', '.join(chunk)})"
+            try:
+                for issue in self._call(self.conn.search_issues, jql, fields="status", maxResults=False):
+                    statuses[issue.key] = issue.fields.status.name
+            except JIRAError as ex:
+                print(f"Failed to search the status of issues {', '.join(chunk)}: {ex}. Fetching them one by one")
+                for issue_key in chunk:
+                    try:
+                        issue = self._call(self.conn.issue, issue_key, fields="status")
+                    except JIRAError as ex:
+                        print(f"Failed to fetch the status of issue {issue_key}: {ex}")
+                        continue
+                    statuses[issue_key] = issue.fields.status.name
+        return statuses
+
+    def _call(self, func, *args, **kwargs):
+        with self.service_limits("jira"):
+            return self.rate_limiter.call(func, *args, **kwargs)
@@ -0,0 +1,160 @@
+import threading
+from lib.ansibleoutput import AnsibleOutputParser
+from lib.batchcollector import BatchCollector
+from lib.hvlocal import Results
+
+
+# location of the wrapper scripts in the HOME directory on the Kayobe host
+SCRIPTS_DIR = "~/no_way_i_am_doing_this_manually/scripts"
+
+# wrapper scripts whose playbook does not target the given hosts,
+# so every host gets the whole output
+NOT_HOST_SPECIFIC = ["inventory_from_netbox.sh", "kayobe_overcloud_deploy_controller.sh"]
+
+
+def run_on_kayobe_host(migration_manager, cmd, on_line=None):
+    """
+    Run a command on the Kayobe host, on a new channel of the pooled
+    connection, forwarding the run's ssh-agent with the Kayobe key,
+    so Ansible can reach the HyperVisors from there.
+
+    Parameters
+    ----------
+    migration_manager : MigrationManager
+        Manager providing the credentials, SSH pool and ssh-agent.
+    cmd : str
+        Command line to execute remotely.
+    on_line : callable, optional
+        If given, the output is streamed to it, and the returned stdout is empty.
+    Returns
+    -------
+    Results
+        Execution results from :meth:`SSHConnectionPool.exec_command`.
+    """
+    kayobe = migration_manager.credentials_handler.kayobe
+    agent = migration_manager.ssh_agent
+    return migration_manager.ssh_pool.exec_command(
+        kayobe.hostname,
+        kayobe.username,
+        cmd,
+        pkey=agent.add_key(kayobe.nopassfile),
+        agent=agent,
+        on_line=on_line,
+    )
+
+
+class KayobeBatch:
+    def __init__(self, migration_manager, window=0, forks=5, abort_on_fatal=False):
+        """
+        Run the Kayobe wrapper scripts once for many HyperVisors
+
+        The HyperVisors that need the same playbook during a step are
+        gathered by a BatchCollector, and the wrapper script runs once
+        for all of them, i.e. with --limit host1:host2:..., in chunks of
+        at most forks hosts. The PLAY RECAP and the failed tasks of each
+        host are then reported to its own Jira ticket.
+
+        Parameters
+        ----------
+        migration_manager : MigrationManager
+            Manager providing the credentials, service limits and participants.
+        window : float
+            Maximum number of seconds to wait for the rest of HyperVisors.
+            0 disables batching.
+        forks : int
+            Maximum number of hosts in a single run, as the Ansible forks.
+        abort_on_fatal : bool
+            Stop a playbook as soon as all its hosts had a fatal error.
+        """
+        self.migration_manager = migration_manager
+        self.service_limits = migration_manager.service_limits
+        self.participants = migration_manager.participants
+        self.window = window
+        self.forks = forks
+        self.abort_on_fatal = abort_on_fatal
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def submit(self, script, hostname):
+        """
+        Add a HyperVisor to the next run of a wrapper script,
+        and wait for its own slice of the results
+        """
+        return self._collector(script).submit(hostname, None)
+
+    def skip(self, script, hostname):
+        """
+        Tell the next run of a wrapper script not to wait for a HyperVisor
+        """
+        self._collector(script).skip(hostname)
+
+    def run_playbook(self, cmd, hosts=None):
+        """
+        Run a wrapper script on the Kayobe host, parsing its output as it
+        is printed, and stopping it early if configured to
+        Parameters
+        ----------
+        cmd : str
+            Command line to execute remotely.
+        hosts : list of str, optional
+            Hosts targeted by the playbook.
+        Returns
+        -------
+        tuple(Results, AnsibleOutputParser)
+            Stderr and return code of the script, with the summary of
+            its output as stdout, and the parser with the details.
+        """
+        parser = AnsibleOutputParser(hosts=hosts, abort_on_fatal=self.abort_on_fatal)
+
+        def on_line(line):
+            parser.feed(line)
+            return parser.should_abort
+
+        with self.service_limits("kayobe"):
+            results = run_on_kayobe_host(self.migration_manager, cmd, on_line=on_line)
+        if parser.should_abort:
+            results.stderr = f"stopped after a fatal error for every host\n{results.stderr}".strip()
+        results.stdout = parser.report()
+        return results, parser
+
+    def run_script(self, script, hostnames):
+        """
+        Run a wrapper script once for one or many HyperVisors
+        Returns
+        -------
+        dict
+            The Results for each hostname, with a return code of 0
+            only if the playbook succeeded for that hostname.
+        """
+        cmd = f"{SCRIPTS_DIR}/{script} {' '.join(hostnames)}"
+        if script in NOT_HOST_SPECIFIC:
+            (results, parser) = self.run_playbook(cmd)
+            if parser.failed_hosts:
+                results.rc = results.rc or 1
+            return {hostname: results for hostname in hostnames}
+        (results, parser) = self.run_playbook(cmd, hosts=hostnames)
+        per_host = {}
+        for hostname in hostnames:
+            failed = parser.failed(hostname)
+            if failed is None:
+                # nothing about it in the output, e.g. the playbook did not even start
+                rc = results.rc or 1
+            else:
+                rc = 1 if failed else 0
+            stdout = parser.report(hostname)
+            if len(hostnames) > 1:
+                stdout = f"output for {hostname}, from a run for {len(hostnames)} hypervisors:\n{stdout}"
+            per_host[hostname] = Results(cmd, stdout, results.stderr, rc)
+        return per_host
+
+    def _collector(self, script):
+        with self._lock:
+            if script not in self._collectors:
+                self._collectors[script] = BatchCollector(
+                    lambda items: self.run_script(script, list(items)),
+                    self.participants,
+                    window=self.window,
+                    max_size=self.forks,
+                )
+            return self._collectors[script]
+
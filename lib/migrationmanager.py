@@ -2,20 +2,80 @@ from lib.credentialshandler import CredentialsHandler
 from lib.hypervisormanager import HyperVisorManager
 from lib.timeinterval import TimeInterval
 from lib.hypervisorgroup import HyperVisorGroup
+from lib.sshpool import SSHConnectionPool
+from lib.sshagent import SSHAgent
+from lib.servicelimits import ServiceLimits
+from lib.serviceclients import ServiceClients
+from lib.netboxinventory import NetboxInventory
+from lib.jirasink import JiraCommentSink
+from lib.ratelimit import RateLimiter
+from lib.jiraworkflow import JiraWorkflow
+from lib.hvjira import OutputLimits
+from lib.silencemanager import SilenceManager
+from lib.aquilonsession import AquilonSession
+from lib.batchcollector import Participants
+from lib.kayobebatch import KayobeBatch
 
 class MigrationManager:
-    def __init__(self, creds_file, hypervisors_file):
+    def __init__(self, creds_file, hypervisors_file, max_workers=None, service_limits=None, jira_rate=10, jira_output_limits=None, wave_silences=False, aquilon_batch_window=0, aquilon_worker=False, kayobe_batch_window=0, kayobe_forks=5, kayobe_abort_on_fatal=False):
         """
         Read HyperVisor lists and coordinate their processing
         Load credentials and parse the list of HyperVisors
+
+        Parameters
+        ----------
+        creds_file : str
+            Path to the YAML file with the credentials.
+        hypervisors_file : str
+            Path to the file with the hostnames and Jira issue keys.
+        max_workers : int, optional
+            Maximum number of HyperVisors processed at the same time.
+        service_limits : dict, optional
+            Maximum number of concurrent calls to each service.
+        jira_rate : float
+            Sustained number of calls per second to Jira, across all HyperVisors.
+        jira_output_limits : OutputLimits, optional
+            Thresholds for summarizing, and attaching, the output of commands in Jira.
+        wave_silences : bool
+            Silence all the HyperVisors in AlertManager with a few regex
+            silences before pre_reinstall, instead of two silences each.
+            The HyperVisors that do not complete pre_reinstall are taken
+            out of them afterwards.
+        aquilon_batch_window : float
+            If not 0, run each Aquilon helper script once for many HyperVisors,
+            waiting up to this number of seconds for them to be ready.
+        aquilon_worker : bool
+            Run the myaq actions in resident workers on the Aquilon host.
+        kayobe_batch_window : float
+            If not 0, run each Kayobe wrapper script once for many HyperVisors,
+            waiting up to this number of seconds for them to be ready.
+        kayobe_forks : int
+            Maximum number of HyperVisors in a single run of a Kayobe wrapper script.
+        kayobe_abort_on_fatal : bool
+            Stop a Kayobe playbook as soon as all its HyperVisors had a fatal error.
         """
         self.time_interval = TimeInterval()
         self.credentials_handler = CredentialsHandler(creds_file)
+        self.ssh_pool = SSHConnectionPool()
+        self.ssh_agent = SSHAgent()
+        self.service_limits = ServiceLimits(service_limits)
+        self.max_workers = max_workers
+        self.service_clients = ServiceClients(self.credentials_handler, pool_size=max_workers or 10)
+        self.jira_rate_limiter = RateLimiter(rate=jira_rate, burst=2 * jira_rate)
+        self.jira_output_limits = jira_output_limits or OutputLimits()
+        self.jira_sink = JiraCommentSink(self.service_clients, self.service_limits, self.jira_rate_limiter)
         self.hvgroup = self._parse_hypervisors_file(hypervisors_file)
+        self.netbox_inventory = NetboxInventory(self, [hv.hostname for hv in self.hvgroup])
+        self.jira_workflow = JiraWorkflow(self, [hv.jira_issue_key for hv in self.hvgroup])
+        self.silence_manager = SilenceManager(self, [hv.hostname for hv in self.hvgroup])
+        self.participants = Participants()
+        self.aquilon_session = AquilonSession(self, batch_window=aquilon_batch_window, worker=aquilon_worker)
+        self.kayobe_batch = KayobeBatch(self, window=kayobe_batch_window, forks=kayobe_forks, abort_on_fatal=kayobe_abort_on_fatal)
+        self.wave_silences = wave_silences
 
     def _parse_hypervisors_file(self, hypervisors_file):
         # Open the file in read mode
-        hvgroup = HyperVisorGroup(self)
+        hvgroup = HyperVisorGroup(self, self.max_workers)
         with open(hypervisors_file, 'r') as file:
             # Iterate over each line in the file
             for line in file:
@@ -31,6 +91,43 @@ class MigrationManager:
         return hvgroup
 
     def run(self, step):
-        self.hvgroup.run(step)
+        try:
+            if step == "pre_reinstall" and self.wave_silences:
+                self.silence_manager.create_wave_silences()
+            results = self.hvgroup.run(step)
+            if step == "pre_reinstall" and self.wave_silences:
+                # the wave silences were created before the checks, the
+                # HyperVisors that did not pass them are not reinstalled
+                self._expire_silences([result.hostname for result in results if result.status != "ok"])
+            if step == "post_reinstall":
+                self._expire_silences([result.hostname for result in results if result.status == "ok"])
+            return results
+        finally:
+            self.close()
+            print(f"Jira API usage: {self.jira_rate_limiter.summary}")
+
+    def close(self):
+        """
+        Stop the background threads, and close the connections
+        and sessions shared by all the HyperVisors
+        """
+        self.aquilon_session.close()
+        self.ssh_pool.close_all()
+        self.ssh_agent.close()
+        self.jira_sink.close()
+        self.service_clients.close()
+
+    def _expire_silences(self, hostnames):
+        """
+        Expire, in bulk, the silences of some HyperVisors,
+        and report it to their Jira tickets
+        """
+        if not hostnames:
+            return
+        messages = self.silence_manager.expire_silences(hostnames)
+        for hv in self.hvgroup:
+            if hv.hostname in messages:
+                hv.jira.add("\n".join(messages[hv.hostname]))
+                hv.jira.send_buffer()
 
 
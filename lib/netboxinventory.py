@@ -0,0 +1,274 @@
+import csv
+import json
+import sys
+import threading
+from lib.serviceclients import NETBOX_URL
+
+
+class NetboxInventory:
+    def __init__(self, migration_manager, hostnames, chunk_size=50):
+        """
+        In-memory index of the NetBox devices for all the HyperVisors in the run
+
+        The first time any HyperVisor needs its device, all the listed
+        devices, and their device types, are fetched in a few paginated
+        requests filtering by many names at once, instead of issuing
+        one request per HyperVisor.
+
+        Parameters
+        ----------
+        migration_manager : MigrationManager
+            Manager providing the shared NetBox client and service limits.
+        hostnames : list of str
+            Names of all the HyperVisors in the run.
+        chunk_size : int
+            Maximum number of names (or ids) to filter by in a single request,
+            to keep the URLs to a sensible length.
+        """
+        self.service_clients = migration_manager.service_clients
+        self.service_limits = migration_manager.service_limits
+        self.hostnames = list(hostnames)
+        self.chunk_size = chunk_size
+        self._devices = None
+        self._device_types = {}
+        self._ipmi_addresses = None
+        self._roles = {}
+        self._pending_changes = {}
+        # _load_lock is held while fetching what is only fetched once,
+        # _lock only while reading or updating the caches, never during a request
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self):
+        return self.service_clients.netbox
+
+    def device(self, hostname):
+        """
+        Return the NetBox device for a hostname, or None if it is not registered
+        """
+        self._ensure_loaded()
+        return self._devices.get(hostname)
+
+    def device_type(self, device):
+        """
+        Return the full device type record for a device
+        (the one nested in the device only has a few fields)
+        """
+        self._ensure_loaded()
+        with self._lock:
+            device_type = self._device_types.get(device.device_type.id)
+        if device_type is None:
+            # not prefetched, e.g. the device was not in the initial list
+            with self.service_limits("netbox"):
+                device_type = self.conn.dcim.device_types.get(device.device_type.id)
+            with self._lock:
+                device_type = self._device_types.setdefault(device_type.id, device_type)
+        return device_type
+
+    def ipmi_address(self, hostname):
+        """
+        Return the IP address of the bmc0 interface of a device,
+        or None if it has none
+        """
+        return self.ipmi_addresses().get(hostname)
+
+    def ipmi_addresses(self):
+        """
+        Return the IPMI address of every device in the run, keyed by hostname.
+        They are resolved for all the devices at once the first time,
+        and then cached for the rest of the run.
+        """
+        self._ensure_loaded()
+        with self._load_lock:
+            if self._ipmi_addresses is None:
+                self._ipmi_addresses = self._load_ipmi_addresses()
+            return self._ipmi_addresses
+
+    def export_ipmi_addresses(self, path=None):
+        """
+        Write the IPMI address of every device in the run as CSV,
+        or as JSON if the path ends with .json
+
+        Parameters
+        ----------
+        path : str, optional
+            Output file. If not given, CSV is written to stdout.
+        """
+        rows = []
+        ipmi_addresses = self.ipmi_addresses()
+        for hostname in self.hostnames:
+            device = self._devices.get(hostname)
+            rows.append({
+                "hostname": hostname,
+                "ipmi_address": ipmi_addresses.get(hostname) or "",
+                "netbox_url": f'{NETBOX_URL}/dcim/devices/{device.id}/' if device else "",
+            })
+        out = open(path, 'w', newline='') if path else sys.stdout
+        try:
+            if path and path.endswith('.json'):
+                json.dump(rows, out, indent=2)
+                out.write('\n')
+            else:
+                writer = csv.DictWriter(out, fieldnames=["hostname", "ipmi_address", "netbox_url"])
+                writer.writeheader()
+                writer.writerows(rows)
+        finally:
+            if path:
+                out.close()
+
+    def role(self, name):
+        """
+        Return the device role with the given name, or None if it does not exist.
+        Roles are only fetched once per run.
+        """
+        with self._lock:
+            if name in self._roles:
+                return self._roles[name]
+        with self.service_limits("netbox"):
+            role = self.conn.dcim.device_roles.get(name=name)
+        with self._lock:
+            return self._roles.setdefault(name, role)
+
+    def queue_change(self, hostname, changes_d, jira):
+        """
+        Record status and/or role changes for a device, to be applied
+        in bulk, together with the ones for other devices, by apply_changes()
+
+        Parameters
+        ----------
+        hostname : str
+            Name of the device to change.
+        changes_d : dict
+            New values, e.g. {"status": "active", "role": "Openstack Prod Kolla_Compute"}
+        jira : HVJira
+            Jira helper of the HyperVisor, to report the outcome.
+        """
+        with self._lock:
+            entry = self._pending_changes.setdefault(hostname, {"changes": {}, "jira": jira})
+            entry["changes"].update(changes_d)
+
+    def apply_changes(self):
+        """
+        Apply all the queued changes through the bulk PATCH endpoint,
+        in chunks, and report the outcome for each device to its Jira ticket.
+        If a chunk is rejected, its devices are retried one by one, so a
+        single bad device does not fail the others.
+
+        Returns
+        -------
+        dict
+            For each hostname, None if the changes were applied,
+            or the Exception raised otherwise.
+        """
+        with self._lock:
+            pending = self._pending_changes
+            self._pending_changes = {}
+        outcomes = {}
+        payloads = []
+        for hostname, entry in pending.items():
+            try:
+                payloads.append((hostname, self._change_payload(hostname, entry["changes"])))
+            except Exception as ex:
+                outcomes[hostname] = ex
+        for chunk in self._chunks(payloads):
+            try:
+                with self.service_limits("netbox"):
+                    self.conn.dcim.devices.update([payload for (hostname, payload) in chunk])
+                for (hostname, payload) in chunk:
+                    outcomes[hostname] = None
+            except Exception:
+                for (hostname, payload) in chunk:
+                    try:
+                        with self.service_limits("netbox"):
+                            self.conn.dcim.devices.update([payload])
+                        outcomes[hostname] = None
+                    except Exception as ex:
+                        outcomes[hostname] = ex
+        for hostname, entry in pending.items():
+            self._report_change(hostname, entry["changes"], entry["jira"], outcomes[hostname])
+        return outcomes
+
+    def _change_payload(self, hostname, changes_d):
+        """
+        Build the body for the bulk PATCH request for a single device
+        """
+        device = self.device(hostname)
+        if device is None:
+            raise ValueError(f"there is no info in NetBox for device {hostname}")
+        payload = {"id": device.id}
+        for k,v in changes_d.items():
+            if k == "role":
+                role = self.role(v)
+                if not role:
+                    raise ValueError(f"there is no role '{v}' in NetBox")
+                payload["role"] = role.id
+            if k == "status":
+                payload["status"] = v
+        return payload
+
+    def _report_change(self, hostname, changes_d, jira, exception):
+        """
+        Report the outcome of the bulk update for a single device to Jira
+        """
+        device = self._devices.get(hostname)
+        url = f'{NETBOX_URL}/dcim/devices/{device.id}/' if device else ""
+        if exception is None:
+            for k,v in changes_d.items():
+                msg = f"Successfully updated {k} for device '{hostname}' to '{v}' in Netbox:"
+                msg += "\n"
+                msg += url
+                jira.add(msg)
+        else:
+            jira.add(f"Failed to update device '{hostname}' in Netbox with {changes_d}")
+            jira.add_block(exception)
+            print(f"Failed to update device {hostname} in Netbox: {exception}")
+        jira.send_buffer()
+
+    def _ensure_loaded(self):
+        with self._load_lock:
+            if self._devices is None:
+                self._load()
+
+    def _load(self):
+        """
+        Fetch all the devices, and their device types, in bulk
+        """
+        devices = {}
+        for chunk in self._chunks(self.hostnames):
+            with self.service_limits("netbox"):
+                for device in self.conn.dcim.devices.filter(name=chunk, limit=self.chunk_size):
+                    devices[device.name] = device
+        device_types = {}
+        device_type_ids = sorted({device.device_type.id for device in devices.values()})
+        for chunk in self._chunks(device_type_ids):
+            with self.service_limits("netbox"):
+                for device_type in self.conn.dcim.device_types.filter(id=chunk, limit=self.chunk_size):
+                    device_types[device_type.id] = device_type
+        with self._lock:
+            self._device_types.update(device_types)
+        self._devices = devices
+
+    def _load_ipmi_addresses(self):
+        """
+        Fetch the bmc0 interfaces of all the devices, and their IP addresses,
+        filtering on the server side
+        """
+        hostname_by_device_id = {device.id: name for name, device in self._devices.items()}
+        hostname_by_interface_id = {}
+        for chunk in self._chunks(sorted(hostname_by_device_id)):
+            with self.service_limits("netbox"):
+                for interface in self.conn.dcim.interfaces.filter(device_id=chunk, name="bmc0", limit=self.chunk_size):
+                    hostname_by_interface_id[interface.id] = hostname_by_device_id[interface.device.id]
+        ipmi_addresses = {}
+        for chunk in self._chunks(sorted(hostname_by_interface_id)):
+            with self.service_limits("netbox"):
+                for ip in self.conn.ipam.ip_addresses.filter(interface_id=chunk, limit=self.chunk_size):
+                    hostname = hostname_by_interface_id[ip.assigned_object_id]
+                    # keep the first address, if the interface has more than one
+                    ipmi_addresses.setdefault(hostname, ip.address.split('/')[0])
+        return ipmi_addresses
+
+    def _chunks(self, items):
+        for i in range(0, len(items), self.chunk_size):
+            yield items[i:i + self.chunk_size]
@@ -0,0 +1,144 @@
+import random
+import threading
+import time
+
+
+# HTTP status codes that mean "slow down and try again later"
+THROTTLED_STATUS_CODES = (429, 503)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        """
+        Thread-safe token bucket
+
+        Parameters
+        ----------
+        rate : float
+            Tokens added per second, i.e. the sustained number of calls per second.
+        capacity : int
+            Maximum number of tokens, i.e. the size of the bursts allowed.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take one token, waiting until there is one available
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Stop handing out tokens, to every caller, for some time.
+        Used when the server asks us to back off.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+class RateLimiter:
+    def __init__(self, rate=10, burst=20, max_retries=6, base_delay=1, max_delay=120):
+        """
+        Shared, thread-safe rate limiter for the calls to a remote API
+
+        Every call takes a token from a shared bucket first. When the
+        server answers with HTTP 429 (or 503), every caller pauses for the
+        time requested in the Retry-After header (or an exponential
+        backoff if there is none), and the call is retried with jitter.
+
+        Parameters
+        ----------
+        rate : float
+            Sustained number of calls per second.
+        burst : int
+            Maximum number of calls in a burst.
+        max_retries : int
+            Maximum number of retries for a throttled call.
+        base_delay : float
+            Initial backoff, in seconds, when there is no Retry-After header.
+        max_delay : float
+            Maximum backoff, in seconds.
+        """
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.calls = 0
+        self.throttled = 0
+        self.retried = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) within the rate limit,
+        retrying it if the server throttles it
+        """
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            self._count("calls")
+            try:
+                return func(*args, **kwargs)
+            except Exception as ex:
+                status_code, retry_after = self._throttling_info(ex)
+                if status_code not in THROTTLED_STATUS_CODES:
+                    raise
+                self._count("throttled")
+                if attempt >= self.max_retries:
+                    self._count("failed")
+                    raise
+                delay = retry_after if retry_after is not None else self.base_delay * 2 ** attempt
+                delay = min(delay, self.max_delay)
+                self.bucket.pause(delay)
+                # spread the retries from all the threads waiting on the bucket
+                time.sleep(delay + random.uniform(0, self.base_delay))
+                attempt += 1
+                self._count("retried")
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _throttling_info(self, ex):
+        """
+        Return the HTTP status code of a failed call, and the Retry-After
+        value in seconds if the server sent one
+        """
+        response = getattr(ex, "response", None)
+        status_code = getattr(ex, "status_code", None) or getattr(response, "status_code", None)
+        retry_after = None
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                retry_after = None
+        return status_code, retry_after
+
+    @property
+    def summary(self):
+        """
+        Return the counters as a single line of text
+        """
+        return (
+            f"calls: {self.calls}, throttled: {self.throttled}, "
+            f"retried: {self.retried}, failed after retries: {self.failed}"
+        )
@@ -0,0 +1,138 @@
+import threading
+import jira
+import openstack
+import pynetbox
+import requests
+
+
+JIRA_URL = "https://stfc.atlassian.net/"
+NETBOX_URL = "https://netbox.esc.rl.ac.uk/"
+OPENSTACK_AUTH_URL = "https://openstack.stfc.ac.uk:5000/v3"
+ALERTMANAGER_URL = "https://openstack.stfc.ac.uk:9093"
+
+
+class ServiceClients:
+    def __init__(self, creds_handler, pool_size=10):
+        """
+        Registry of the API clients shared by all the HyperVisors
+
+        Each client is created the first time it is requested, and then
+        handed out to every HyperVisor, so a run authenticates only once
+        against each service and keeps a single HTTP connection pool
+        per service, whatever the number of HyperVisors.
+
+        Parameters
+        ----------
+        creds_handler : CredentialsHandler
+            Credentials for all the services.
+        pool_size : int
+            Maximum number of HTTP connections kept open to each service,
+            typically the number of HyperVisors processed in parallel.
+        """
+        self.creds_handler = creds_handler
+        self.pool_size = pool_size
+        self._clients = {}
+        self._locks = {name: threading.Lock() for name in ["jira", "netbox", "openstack", "alertmanager"]}
+
+    @property
+    def jira(self):
+        """
+        Return the shared jira.client.JIRA object
+        """
+        return self._get("jira", self._new_jira)
+
+    @property
+    def netbox(self):
+        """
+        Return the shared pynetbox.api object
+        """
+        return self._get("netbox", self._new_netbox)
+
+    @property
+    def openstack(self):
+        """
+        Return the shared openstack.connection.Connection object
+        """
+        return self._get("openstack", self._new_openstack)
+
+    @property
+    def alertmanager(self):
+        """
+        Return the shared requests.Session for the AlertManager API
+        """
+        return self._get("alertmanager", self._new_alertmanager)
+
+    def _get(self, name, factory):
+        """
+        Return the client with the given name, creating it if needed
+        """
+        with self._locks[name]:
+            if name not in self._clients:
+                self._clients[name] = factory()
+            return self._clients[name]
+
+    def _new_jira(self):
+        conn = jira.client.JIRA(
+            server=JIRA_URL,
+            basic_auth=(self.creds_handler.jira.username, self.creds_handler.jira.api_token),
+            # retries of throttled calls are handled by the shared RateLimiter
+            max_retries=0,
+        )
+        self._mount_adapter(conn._session)
+        return conn
+
+    def _new_netbox(self):
+        conn = pynetbox.api(NETBOX_URL, token=self.creds_handler.netbox.api_token)
+        session = requests.Session()
+        self._mount_adapter(session)
+        conn.http_session = session
+        return conn
+
+    def _new_openstack(self):
+        conn = openstack.connection.Connection(
+            auth_url = OPENSTACK_AUTH_URL,
+            project_name = "admin",
+            username = self.creds_handler.openstack.username,
+            password = self.creds_handler.openstack.password,
+            user_domain_name = "default",
+            project_domain_name = "default",
+            verify=True
+        )
+        # all threads share the keystoneauth session, and therefore
+        # a single Keystone token
+        self._mount_adapter(conn.session.session)
+        return conn
+
+    def _new_alertmanager(self):
+        session = requests.Session()
+        session.auth = requests.auth.HTTPBasicAuth(
+            self.creds_handler.alertmanager.username,
+            self.creds_handler.alertmanager.password,
+        )
+        session.headers.update({"Content-Type": "application/json"})
+        self._mount_adapter(session)
+        return session
+
+    def _mount_adapter(self, session):
+        """
+        Size the HTTP connection pool of a requests.Session so it can
+        serve all the threads without discarding connections
+        """
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+    def close(self):
+        """
+        Close the HTTP sessions of all the clients created so far
+        """
+        for name, conn in list(self._clients.items()):
+            if name == "jira":
+                conn.close()
+            elif name == "netbox":
+                conn.http_session.close()
+            elif name == "openstack":
+                conn.close()
+            elif name == "alertmanager":
+                conn.close()
+        self._clients.clear()
@@ -0,0 +1,100 @@
+import contextlib
+import threading
+
+
+# services that can be capped
+SERVICES = ["jira", "netbox", "openstack", "alertmanager", "aquilon", "kayobe"]
+
+# maximum number of concurrent calls to a service, across all HyperVisors,
+# when not specified otherwise
+DEFAULT_LIMITS = {
+    "aquilon": 2,
+    "jira": 8,
+}
+
+
+class ServiceLimits:
+    def __init__(self, limits=None):
+        """
+        Per-service concurrency caps shared by all the HyperVisors
+
+        Parameters
+        ----------
+        limits : dict, optional
+            Maximum number of concurrent calls for each service name,
+            e.g. {"aquilon": 2, "jira": 8}. They override DEFAULT_LIMITS.
+            Services without a limit are not capped.
+        """
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self._semaphores = {
+            service: threading.BoundedSemaphore(limit)
+            for service, limit in self.limits.items()
+            if limit
+        }
+
+    def __call__(self, service):
+        """
+        Return a context manager to hold while calling the given service
+
+            with self.service_limits("jira"):
+                self.conn.add_comment(...)
+        """
+        semaphore = self._semaphores.get(service)
+        if semaphore is None:
+            return contextlib.nullcontext()
+        return semaphore
+
+    def limit(self, service):
+        """
+        Return the concurrency cap for a service, or None if not capped
+        """
+        return self.limits.get(service) or None
+
+    @staticmethod
+    def parse_spec(spec):
+        """
+        Parse a command line value like "aquilon=2"
+
+        Parameters
+        ----------
+        spec : str
+            Value with format SERVICE=N
+        Returns
+        -------
+        tuple(str, int)
+            The service and its limit.
+        Raises
+        ------
+        ValueError
+            If the value is not in that format, the service is not
+            one of SERVICES, or N is negative.
+        """
+        (service, sep, limit) = spec.partition('=')
+        if not sep or not service.strip():
+            raise ValueError(f"expected SERVICE=N, got {spec!r}")
+        service = service.strip()
+        if service not in SERVICES:
+            raise ValueError(f"unknown service {service!r}, expected one of: {', '.join(SERVICES)}")
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError(f"the limit must be an integer, got {spec!r}")
+        if limit < 0:
+            raise ValueError(f"the limit cannot be negative, got {spec!r}")
+        return (service, limit)
+
+    @staticmethod
+    def parse(specs):
+        """
+        Build the limits dictionary from command line values like "aquilon=2"
+
+        Parameters
+        ----------
+        specs : list of str
+            Values with format SERVICE=N
+        Returns
+        -------
+        dict
+        """
+        return dict(ServiceLimits.parse_spec(spec) for spec in specs or [])
@@ -0,0 +1,359 @@
+import re
+import requests
+import threading
+from datetime import datetime
+from lib.serviceclients import ALERTMANAGER_URL
+
+
+# labels that identify a HyperVisor in the alerts
+LABELS = ["hostname", "instance"]
+
+# all the silences created by this automation have a comment starting like this
+COMMENT_PREFIX = "RL9 Reinstall"
+
+
+class SilenceManager:
+    def __init__(self, migration_manager, hostnames, max_regex_size=2000):
+        """
+        AlertManager silences for all the HyperVisors in the run
+
+        The silences already in AlertManager are fetched once per run,
+        and indexed by HyperVisor and label, so a HyperVisor that is
+        already silenced (e.g. when a step is run again) reuses its
+        silences, extended if they end too soon, instead of getting
+        new ones.
+
+        In wave mode, instead of two silences per HyperVisor, a single
+        regex silence per label covers many HyperVisors at once, so
+        silencing a whole wave only takes a handful of requests.
+
+        Parameters
+        ----------
+        migration_manager : MigrationManager
+            Manager providing the shared AlertManager session, the
+            credentials, the time interval and the service limits.
+        hostnames : list of str
+            Names of all the HyperVisors in the run.
+        max_regex_size : int
+            Maximum length of the regex of a single matcher.
+            The hostnames are split into as many silences as needed.
+        """
+        self.service_clients = migration_manager.service_clients
+        self.service_limits = migration_manager.service_limits
+        self.creds_handler = migration_manager.credentials_handler
+        self.time_interval = migration_manager.time_interval
+        self.hostnames = list(hostnames)
+        self.max_regex_size = max_regex_size
+        self._silences = None
+        self._index = {}
+        self._lock = threading.RLock()
+
+    @property
+    def session(self):
+        return self.service_clients.alertmanager
+
+    # =========================================================================
+    #       create
+    # =========================================================================
+
+    def create_wave_silences(self):
+        """
+        Create the regex silences covering all the HyperVisors in the run
+        that are not silenced yet, for all the labels.
+        HyperVisors left uncovered, because a request failed, get their
+        own silences later on, when the step runs for them.
+        """
+        for label in LABELS:
+            hostnames = [hostname for hostname in self.hostnames if self.existing(hostname, label) is None]
+            for chunk in self._chunks(hostnames):
+                try:
+                    silence_id = self.create(label, chunk)
+                except Exception as ex:
+                    print(f"Failed to create the {label} silence for {', '.join(chunk)}: {ex}")
+                    continue
+                print(f"Silence for {label} of {len(chunk)} hypervisors: {self.url(silence_id)}")
+
+    def covering(self, hostname):
+        """
+        Return the ids of the silences covering a HyperVisor, keyed by label.
+        Labels without a silence are left out.
+        """
+        silences = {}
+        for label in LABELS:
+            silence_id = self.existing(hostname, label)
+            if silence_id is not None:
+                silences[label] = silence_id
+        return silences
+
+    def existing(self, hostname, label):
+        """
+        Return the id of a silence for a HyperVisor and label, or None if
+        there is none.
+        Any silence lasting until the end of the time interval of the run
+        is reused as it is. Otherwise only a silence created by this
+        automation is extended, those of other people are left alone.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            silences = [self._silences[silence_id] for silence_id in self._index.get((hostname, label), [])]
+            end = _parse_time(self.time_interval.end_str)
+            lasting = [silence for silence in silences if _parse_time(silence["endsAt"]) >= end]
+            if lasting:
+                return lasting[0]["id"]
+            own = [silence for silence in silences if _created_here(silence)]
+            if not own:
+                return None
+            silence = max(own, key=lambda silence: _parse_time(silence["endsAt"]))
+            try:
+                silence = self._extend(silence)
+            except Exception as ex:
+                print(f"Failed to extend silence {self.url(silence['id'])}: {ex}")
+                return None
+            return silence["id"]
+
+    def create(self, label, hostnames):
+        """
+        Create a silence for a label, matching one or many HyperVisors,
+        for the time interval of the run
+        Returns
+        -------
+        str
+            id of the new silence
+        """
+        silence = {
+            "matchers": [self._matcher(label, hostnames)],
+            "startsAt": self.time_interval.start_str,
+            "endsAt": self.time_interval.end_str,
+            "createdBy": "admin",
+            "comment": f"{COMMENT_PREFIX} {self.time_interval.start_str} - {self.creds_handler.general.initials}"
+        }
+        return self._post(silence)["id"]
+
+    # =========================================================================
+    #       expire
+    # =========================================================================
+
+    def expire_silences(self, hostnames):
+        """
+        Stop silencing some HyperVisors, e.g. once they are reinstalled.
+        Only the silences created by this automation are considered.
+        Silences for a single HyperVisor are expired. Regex silences that
+        still cover other HyperVisors are replaced by a narrower one.
+        Returns
+        -------
+        dict
+            For each HyperVisor, the list of messages describing what was done.
+        """
+        hostnames = set(hostnames)
+        messages = {}
+        with self._lock:
+            self._ensure_loaded()
+            silence_ids = {
+                silence_id
+                for (hostname, label), ids in self._index.items() if hostname in hostnames
+                for silence_id in ids
+            }
+            for silence_id in sorted(silence_ids):
+                silence = self._silences[silence_id]
+                if not _created_here(silence):
+                    continue
+                matcher = silence["matchers"][0]
+                covered = _hostnames(matcher)
+                if covered is None:
+                    # a regex not created by us, do not guess what else it covers
+                    print(f"Not expiring silence {self.url(silence_id)}, regex {matcher['value']} not understood")
+                    continue
+                remaining = [hostname for hostname in covered if hostname not in hostnames]
+                try:
+                    if remaining:
+                        narrowed = {key: silence[key] for key in ["startsAt", "endsAt", "createdBy", "comment"]}
+                        narrowed["matchers"] = [self._matcher(matcher["name"], remaining)]
+                        new_id = self._post(narrowed)["id"]
+                        msg = f"Silence for {matcher['name']} {self.url(silence_id)} replaced by {self.url(new_id)}, for the other hypervisors only"
+                    else:
+                        msg = f"Silence for {matcher['name']} {self.url(silence_id)} expired"
+                    self._delete(silence_id)
+                except Exception as ex:
+                    msg = f"Failed to expire silence for {matcher['name']} {self.url(silence_id)}: {ex}"
+                for hostname in covered:
+                    if hostname in hostnames:
+                        messages.setdefault(hostname, []).append(msg)
+        return messages
+
+    # =========================================================================
+    #       index
+    # =========================================================================
+
+    def _ensure_loaded(self):
+        """
+        Fetch the active and pending silences, the first time they are needed
+        """
+        with self._lock:
+            if self._silences is not None:
+                return
+            self._silences = {}
+            try:
+                with self.service_limits("alertmanager"):
+                    response = self.session.get(f"{ALERTMANAGER_URL}/api/v2/silences")
+                self._check(response)
+            except Exception as ex:
+                # carry on as if there were none, at worst we get duplicates
+                print(f"Failed to fetch the existing silences from AlertManager: {ex}")
+                return
+            for silence in response.json():
+                if silence["status"]["state"] in ["active", "pending"]:
+                    self._add(silence)
+
+    def _add(self, silence):
+        """
+        Add a silence to the index of the HyperVisors in the run it covers.
+        Only silences with a single, positive, matcher on one of the
+        labels silence all the alerts of a HyperVisor.
+        """
+        matchers = silence["matchers"]
+        if len(matchers) != 1 or matchers[0]["name"] not in LABELS or not matchers[0].get("isEqual", True):
+            return
+        matcher = matchers[0]
+        self._silences[silence["id"]] = silence
+        for hostname in self.hostnames:
+            if _matches(matcher, hostname):
+                self._index.setdefault((hostname, matcher["name"]), []).append(silence["id"])
+
+    def _remove(self, silence_id):
+        """
+        Drop a silence from the index
+        """
+        self._silences.pop(silence_id, None)
+        for ids in self._index.values():
+            if silence_id in ids:
+                ids.remove(silence_id)
+
+    # =========================================================================
+    #       API calls
+    # =========================================================================
+
+    def _post(self, silence):
+        """
+        Create, or update if it has an id, a silence, and keep the index up to date
+        Returns
+        -------
+        dict
+            The silence, with its id.
+        """
+        with self.service_limits("alertmanager"):
+            response = self.session.post(f"{ALERTMANAGER_URL}/api/v2/silences", json=silence)
+        self._check(response)
+        silence = dict(silence, id=response.json()["silenceID"], status={"state": "active"})
+        with self._lock:
+            self._ensure_loaded()
+            # AlertManager may replace the updated silence by a new one
+            self._remove(silence["id"])
+            self._add(silence)
+        return silence
+
+    def _extend(self, silence):
+        """
+        Make a silence created by this automation last until the end
+        of the time interval of the run
+        """
+        if not _created_here(silence):
+            raise ValueError(f"silence {silence['id']} was not created by this automation")
+        extended = {
+            key: silence[key]
+            for key in ["id", "matchers", "startsAt", "createdBy", "comment"]
+        }
+        extended["endsAt"] = self.time_interval.end_str
+        new = self._post(extended)
+        if new["id"] != silence["id"]:
+            self._remove(silence["id"])
+        return new
+
+    def _delete(self, silence_id):
+        """
+        Expire a silence
+        """
+        with self.service_limits("alertmanager"):
+            response = self.session.delete(f"{ALERTMANAGER_URL}/api/v2/silence/{silence_id}")
+        self._check(response)
+        with self._lock:
+            self._remove(silence_id)
+
+    def _check(self, response):
+        """
+        Raise an exception, with the reason given by AlertManager, if a request failed
+        """
+        if response.status_code != 200:
+            raise requests.HTTPError(f"Response status code: {response.status_code}, {response.text}", response=response)
+
+    # =========================================================================
+    #       helpers
+    # =========================================================================
+
+    def url(self, silence_id):
+        """
+        Return the link to a silence in the AlertManager UI
+        """
+        return f"{ALERTMANAGER_URL}/#/silences/{silence_id}"
+
+    def _matcher(self, label, hostnames):
+        """
+        Return a matcher for a label matching any of the hostnames
+        """
+        if len(hostnames) == 1:
+            return {"name": label, "value": hostnames[0], "isRegex": False}
+        return {"name": label, "value": "|".join(re.escape(hostname) for hostname in hostnames), "isRegex": True}
+
+    def _chunks(self, hostnames):
+        """
+        Split the hostnames so the regex for each chunk is within max_regex_size
+        """
+        chunk, size = [], 0
+        for hostname in hostnames:
+            length = len(re.escape(hostname)) + 1
+            if chunk and size + length > self.max_regex_size:
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(hostname)
+            size += length
+        if chunk:
+            yield chunk
+
+
+def _parse_time(timestamp):
+    """
+    Parse a timestamp as returned by AlertManager, or as in TimeInterval
+    """
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+
+def _created_here(silence):
+    """
+    Return True if a silence was created by this automation
+    """
+    return silence.get("comment", "").startswith(COMMENT_PREFIX)
+
+
+def _matches(matcher, hostname):
+    """
+    Return True if a matcher matches a hostname
+    """
+    if not matcher.get("isRegex"):
+        return matcher["value"] == hostname
+    try:
+        # AlertManager anchors the regex at both ends
+        return re.fullmatch(matcher["value"], hostname) is not None
+    except re.error:
+        return False
+
+
+def _hostnames(matcher):
+    """
+    Return the hostnames matched by a matcher created by this automation,
+    or None if the regex is not a plain list of alternative hostnames
+    """
+    if not matcher.get("isRegex"):
+        return [matcher["value"]]
+    hostnames = [re.sub(r"\\(.)", r"\1", part) for part in matcher["value"].split("|")]
+    if "|".join(re.escape(hostname) for hostname in hostnames) != matcher["value"]:
+        return None
+    return hostnames
@@ -0,0 +1,115 @@
+import os
+import re
+import signal
+import subprocess
+import threading
+import paramiko
+from paramiko.agent import AgentClientProxy
+
+
+class SSHAgent:
+    def __init__(self):
+        """
+        Single ssh-agent for the whole run
+
+        It is started the first time a key is added, holds the keys that
+        must be forwarded to a remote host (e.g. the Kayobe host, where
+        Ansible uses them to reach the HyperVisors), and is stopped at
+        the end of the run. Paramiko finds it through SSH_AUTH_SOCK,
+        which is set in this process while the agent runs.
+        """
+        self._pid = None
+        self._sock = None
+        self._previous_sock = None
+        self._agent = None
+        self._keys = {}
+        self._proxies = []
+        self._lock = threading.Lock()
+
+    def add_key(self, keyfile):
+        """
+        Load a private key, without passphrase, into the agent,
+        starting the agent if needed. Adding the same file again
+        does nothing.
+        Parameters
+        ----------
+        keyfile : str
+            Path to the private key file.
+        Returns
+        -------
+        paramiko.AgentKey
+            The key, as held by the agent, to authenticate with it.
+        """
+        with self._lock:
+            if keyfile in self._keys:
+                return self._keys[keyfile]
+            if self._pid is None:
+                self._start()
+            before = {key.get_fingerprint() for key in self._agent.get_keys()}
+            subprocess.run(
+                ["ssh-add", os.path.expanduser(keyfile)],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+            )
+            # the connection to the agent caches the list of keys
+            self._agent.close()
+            self._agent = paramiko.Agent()
+            added = [key for key in self._agent.get_keys() if key.get_fingerprint() not in before]
+            if not added:
+                raise paramiko.SSHException(f"no new key in the ssh-agent after adding {keyfile}")
+            self._keys[keyfile] = added[0]
+            return added[0]
+
+    def _start(self):
+        """
+        Start ssh-agent, and point SSH_AUTH_SOCK to it
+        """
+        output = subprocess.run(
+            ["ssh-agent", "-s"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True,
+        ).stdout
+        # e.g. "SSH_AUTH_SOCK=/tmp/ssh-XXXX/agent.123; export SSH_AUTH_SOCK;"
+        variables = dict(re.findall(r"(SSH_AUTH_SOCK|SSH_AGENT_PID)=([^;]+);", output))
+        self._sock = variables["SSH_AUTH_SOCK"]
+        self._pid = int(variables["SSH_AGENT_PID"])
+        self._previous_sock = os.environ.get("SSH_AUTH_SOCK")
+        os.environ["SSH_AUTH_SOCK"] = self._sock
+        self._agent = paramiko.Agent()
+
+    def forward(self, channel):
+        """
+        Request agent forwarding on a channel, before running a command on it
+        """
+        channel.request_forward_agent(self._handle_forward)
+
+    def _handle_forward(self, remote_channel):
+        """
+        Serve a connection from the remote host to the forwarded agent
+        """
+        with self._lock:
+            proxy = AgentClientProxy(remote_channel)
+            # forget the connections already closed by the remote host
+            self._proxies = [p for p in self._proxies if p.thread.is_alive()]
+            self._proxies.append(proxy)
+
+    def close(self):
+        """
+        Stop serving forwarded connections, and stop the agent
+        """
+        with self._lock:
+            for proxy in self._proxies:
+                proxy.close()
+            self._proxies = []
+            if self._agent is not None:
+                self._agent.close()
+                self._agent = None
+            if self._pid is not None:
+                try:
+                    os.kill(self._pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+                if self._previous_sock is None:
+                    os.environ.pop("SSH_AUTH_SOCK", None)
+                else:
+                    os.environ["SSH_AUTH_SOCK"] = self._previous_sock
+                self._pid = None
+            self._keys = {}
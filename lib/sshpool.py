@@ -0,0 +1,217 @@
+import threading
+import paramiko
+from lib.hvlocal import OutputBuffer, Results
+
+
+# bytes of each of stdout and stderr kept in memory, the rest is spilled to disk
+MAX_OUTPUT = 256 * 1024
+
+
+class SSHConnectionPool:
+    def __init__(self, keepalive=30, timeout=10, max_output=MAX_OUTPUT):
+        """
+        Process-wide pool of authenticated SSH connections
+
+        Connections are keyed by (hostname, username) and kept open for
+        the duration of the run, so every remote command only pays for
+        opening a new channel on an already authenticated Transport,
+        instead of a full TCP + key exchange + authentication handshake.
+
+        Parameters
+        ----------
+        keepalive : int
+            Interval, in seconds, between keepalive packets sent on idle
+            connections.
+        timeout : int
+            Timeout, in seconds, for establishing a new connection.
+        max_output : int
+            Bytes of each of stdout and stderr of a command kept in memory.
+            A longer output is spilled, in full, to a compressed log for its
+            host (see :class:`hvlocal.OutputBuffer`).
+        """
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.max_output = max_output
+        self._clients = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key):
+        """
+        Return the lock serialising (re)connections for a given key
+        """
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get_transport(self, hostname, username, pkey=None, password=None, port=22):
+        """
+        Return an active, authenticated Transport for (hostname, username).
+        A new connection is only established if there is none yet
+        or the existing one is no longer active.
+
+        Parameters
+        ----------
+        hostname : str
+            Remote host to connect to.
+        username : str
+            Remote account to authenticate as.
+        pkey : paramiko.PKey, optional
+            Private key used for authentication.
+        password : str, optional
+            Password used for authentication.
+        port : int
+            Remote SSH port.
+        Returns
+        -------
+        paramiko.Transport
+        """
+        key = (hostname, username)
+        with self._key_lock(key):
+            client = self._clients.get(key)
+            if client is not None:
+                transport = client.get_transport()
+                if transport is not None and transport.is_active():
+                    return transport
+                client.close()
+                del self._clients[key]
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(
+                hostname=hostname,
+                port=port,
+                username=username,
+                pkey=pkey,
+                password=password,
+                timeout=self.timeout,
+                allow_agent=False,
+                look_for_keys=False,
+            )
+            transport = client.get_transport()
+            transport.set_keepalive(self.keepalive)
+            self._clients[key] = client
+            return transport
+
+    def discard(self, hostname, username):
+        """
+        Close and forget the connection for (hostname, username), if any
+        """
+        key = (hostname, username)
+        with self._key_lock(key):
+            client = self._clients.pop(key, None)
+            if client is not None:
+                client.close()
+
+    def exec_command(self, hostname, username, cmd, pkey=None, password=None, port=22, stdin_data=None, agent=None, on_line=None):
+        """
+        Execute a command on a new channel of the pooled connection.
+        If the connection turns out to be broken, reconnect once and retry.
+
+        Parameters
+        ----------
+        hostname : str
+            Remote host to run the command on.
+        username : str
+            Remote account to run the command as.
+        cmd : str
+            Command line to execute remotely.
+        pkey : paramiko.PKey, optional
+            Private key used for authentication.
+        password : str, optional
+            Password used for authentication.
+        port : int
+            Remote SSH port.
+        stdin_data : str, optional
+            Data to feed to the standard input of the remote command.
+        agent : SSHAgent, optional
+            Agent to forward to the remote command.
+        on_line : callable, optional
+            If given, called with each line of stdout as soon as it is
+            received, instead of keeping it, and the returned stdout is
+            empty. If it returns True, the channel is closed, and the
+            return code is -1.
+        Returns
+        -------
+        Results
+            Object containing the command output.
+        """
+        try:
+            transport = self.get_transport(hostname, username, pkey, password, port)
+            channel = transport.open_session(timeout=self.timeout)
+        except paramiko.AuthenticationException:
+            raise
+        except (paramiko.SSHException, EOFError, OSError):
+            # the pooled connection died under us, e.g. the remote sshd
+            # was restarted. Start from scratch once.
+            self.discard(hostname, username)
+            transport = self.get_transport(hostname, username, pkey, password, port)
+            channel = transport.open_session(timeout=self.timeout)
+        if agent is not None:
+            agent.forward(channel)
+        if on_line is not None:
+            return self._stream_on_channel(channel, cmd, on_line, hostname)
+        return self._exec_on_channel(channel, cmd, stdin_data, hostname)
+
+    def _exec_on_channel(self, channel, cmd, stdin_data=None, hostname=None):
+        """
+        Run the command on an open channel and collect its output
+        """
+        stdout = OutputBuffer(self.max_output, spill=hostname)
+        stderr = OutputBuffer(self.max_output, spill=hostname)
+        try:
+            channel.exec_command(cmd)
+            if stdin_data is not None:
+                channel.sendall(stdin_data.encode('utf-8'))
+                channel.shutdown_write()
+            # read stderr at the same time, so the command never blocks on a full window
+            reader = threading.Thread(target=_drain, args=(channel.makefile_stderr('rb'), stderr), daemon=True)
+            reader.start()
+            _drain(channel.makefile('rb'), stdout)
+            reader.join()
+            rc = channel.recv_exit_status()
+        finally:
+            channel.close()
+        return Results(cmd, stdout.getvalue(f"{cmd} (stdout)"), stderr.getvalue(f"{cmd} (stderr)"), rc)
+
+    def _stream_on_channel(self, channel, cmd, on_line, hostname=None):
+        """
+        Run the command on an open channel, passing each line
+        of its stdout to on_line as soon as it arrives
+        """
+        stderr = OutputBuffer(self.max_output, spill=hostname)
+        reader = None
+        try:
+            channel.exec_command(cmd)
+            channel.shutdown_write()
+            # read stderr at the same time, so the command never blocks on a full window
+            reader = threading.Thread(target=_drain, args=(channel.makefile_stderr('rb'), stderr), daemon=True)
+            reader.start()
+            rc = None
+            for line in channel.makefile('rb'):
+                if on_line(line.decode('utf-8', 'replace')):
+                    rc = -1
+                    break
+            if rc is None:
+                rc = channel.recv_exit_status()
+        finally:
+            channel.close()
+            if reader is not None:
+                reader.join(self.timeout)
+        return Results(cmd, "", stderr.getvalue(f"{cmd} (stderr)"), rc)
+
+    def close_all(self):
+        """
+        Close every pooled connection
+        """
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+
+def _drain(f, buffer):
+    """
+    Copy everything read from a channel file into an OutputBuffer
+    """
+    for chunk in iter(lambda: f.read(65536), b""):
+        buffer.write(chunk)
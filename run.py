@@ -2,7 +2,20 @@ import argparse
 import sys
 import textwrap
 
+from lib.argtypes import positive_float, positive_int
 from lib.migrationmanager import MigrationManager
+from lib.servicelimits import SERVICES, ServiceLimits
+from lib.hvjira import OutputLimits
+
+
+def service_limit(value):
+    """
+    argparse type for a SERVICE=N value of --service-limit
+    """
+    try:
+        return ServiceLimits.parse_spec(value)
+    except ValueError as ex:
+        raise argparse.ArgumentTypeError(str(ex))
 
 
 def parse_arguments():
@@ -20,6 +33,103 @@ def parse_arguments():
         default='etc/creds.yaml',
         help='Path to the credentials file (default: etc/creds.yaml)'
     )
+    parser.add_argument(
+        '--max-workers',
+        type=positive_int,
+        default=16,
+        help='Maximum number of hypervisors processed at the same time (default: 16)'
+    )
+    parser.add_argument(
+        '--jira-rate',
+        type=positive_float,
+        default=10,
+        help='Maximum sustained number of calls per second to Jira, across all hypervisors (default: 10)'
+    )
+    parser.add_argument(
+        '--jira-inline-size',
+        type=int,
+        default=OutputLimits.inline_size,
+        help=textwrap.dedent(f"""\
+            Maximum size, in characters, of a command output added in full to a Jira comment.
+            Longer outputs are summarized, and attached compressed to the issue (default: {OutputLimits.inline_size})
+        """)
+    )
+    parser.add_argument(
+        '--jira-summary-lines',
+        type=int,
+        nargs=2,
+        metavar=('HEAD', 'TAIL'),
+        default=[OutputLimits.head_lines, OutputLimits.tail_lines],
+        help=f'Number of first and last lines kept when summarizing a command output (default: {OutputLimits.head_lines} {OutputLimits.tail_lines})'
+    )
+    parser.add_argument(
+        '--wave-silences',
+        action='store_true',
+        help=textwrap.dedent("""\
+            In step pre_reinstall, silence all the hypervisors in AlertManager
+            with a few regex silences, instead of two silences per hypervisor
+        """)
+    )
+    parser.add_argument(
+        '--aquilon-batch-window',
+        type=float,
+        default=0,
+        metavar='SECONDS',
+        help=textwrap.dedent("""\
+            Run each Aquilon helper script (remove_interfaces.py, make_host.py...)
+            once for many hypervisors, waiting up to SECONDS for the rest of
+            them to be ready. 0 runs it once per hypervisor (default: 0)
+        """)
+    )
+    parser.add_argument(
+        '--aquilon-worker',
+        action='store_true',
+        help=textwrap.dedent("""\
+            Run the myaq actions (make_host, pxeswitch_host...) in resident
+            workers on the Aquilon host (scripts/myaq_worker.py), which import
+            myaq only once, instead of starting the helper scripts each time.
+            Takes precedence over --aquilon-batch-window
+        """)
+    )
+    parser.add_argument(
+        '--kayobe-batch-window',
+        type=float,
+        default=0,
+        metavar='SECONDS',
+        help=textwrap.dedent("""\
+            Run each Kayobe wrapper script (host_configure.sh, deploy_hypervisor.sh...)
+            once for many hypervisors, with --limit host1:host2:..., waiting up to
+            SECONDS for the rest of them to be ready. 0 runs it once per hypervisor (default: 0)
+        """)
+    )
+    parser.add_argument(
+        '--kayobe-forks',
+        type=positive_int,
+        default=5,
+        metavar='N',
+        help='Maximum number of hypervisors in a single run of a Kayobe wrapper script (default: 5)'
+    )
+    parser.add_argument(
+        '--kayobe-abort-on-fatal',
+        action='store_true',
+        help=textwrap.dedent("""\
+            Stop a Kayobe playbook as soon as a fatal error is printed for
+            each of its hypervisors, instead of waiting for it to finish
+        """)
+    )
+    parser.add_argument(
+        '--service-limit',
+        type=service_limit,
+        action='append',
+        default=[],
+        metavar='SERVICE=N',
+        help=textwrap.dedent(f"""\
+            Maximum number of concurrent calls to a service, across all hypervisors.
+            Can be given multiple times, e.g. --service-limit aquilon=1 --service-limit jira=4
+            Services: {', '.join(SERVICES)}
+            (default: aquilon=2, jira=8, the rest not capped)
+        """)
+    )
     parser.add_argument(
         '--step',
         required=True,
@@ -68,5 +178,20 @@ def parse_arguments():
 
 if __name__ == '__main__':
     args = parse_arguments()
-    manager = MigrationManager(args.creds_file, args.hypervisors_file)
-    manager.run(args.step)
+    manager = MigrationManager(
+        args.creds_file,
+        args.hypervisors_file,
+        max_workers=args.max_workers,
+        service_limits=dict(args.service_limit),
+        jira_rate=args.jira_rate,
+        jira_output_limits=OutputLimits(args.jira_inline_size, *args.jira_summary_lines),
+        wave_silences=args.wave_silences,
+        aquilon_batch_window=args.aquilon_batch_window,
+        aquilon_worker=args.aquilon_worker,
+        kayobe_batch_window=args.kayobe_batch_window,
+        kayobe_forks=args.kayobe_forks,
+        kayobe_abort_on_fatal=args.kayobe_abort_on_fatal,
+    )
+    results = manager.run(args.step)
+    if any(result.status != "ok" for result in results):
+        sys.exit(1)
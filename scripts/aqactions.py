@@ -0,0 +1,115 @@
+"""
+Shared code for the Aquilon helper scripts
+
+Each script performs an action on one or many hosts, in a single
+interpreter, so the myaq library is imported only once:
+
+    python3 make_host.py HOSTNAME [HOSTNAME ...]
+    echo '["HOSTNAME", "HOSTNAME"]' | python3 make_host.py -
+
+With --json, instead of the human readable output, one JSON document
+is printed per host, on its own line, with keys hostname, cmd, out, err
+and rc (the return code of the first myaq command that failed, or 0).
+"""
+import io
+import json
+import sys
+import traceback
+sys.path.append("/var/quattor/templates/wup22514/lib/python/")
+
+
+class Report:
+    def __init__(self, hostname):
+        """
+        output of an action for a single host
+        """
+        self.hostname = hostname
+        self.cmds = []
+        self.out = io.StringIO()
+        self.err = []
+        self.rc = 0
+
+    def print(self, *args):
+        print(*args, file=self.out)
+
+    def results(self, results, compact=False):
+        """
+        record the results of a myaq command
+        return True if it succeeded
+        """
+        if compact:
+            self.print(f"command: {results.cmd}")
+            self.print(f"stdout: {results.out}")
+            self.print(f"stderr: {results.err}")
+            self.print(f"return code: {results.rc}")
+        else:
+            self.print("cmd: ")
+            self.print(results.cmd)
+            self.print("stdout: ")
+            self.print(results.out)
+            self.print("stderr: ")
+            self.print(results.err)
+            self.print("rc: ")
+            self.print(results.rc)
+        self.cmds.append(str(results.cmd))
+        if results.err:
+            self.err.append(str(results.err))
+        if results.rc != 0 and self.rc == 0:
+            self.rc = results.rc
+        return results.rc == 0
+
+    def exception(self):
+        """
+        record the exception being handled
+        """
+        self.err.append(traceback.format_exc())
+        if self.rc == 0:
+            self.rc = 1
+
+    def as_dict(self):
+        return {
+            "hostname": self.hostname,
+            "cmd": "\n".join(self.cmds),
+            "out": self.out.getvalue(),
+            "err": "\n".join(self.err),
+            "rc": self.rc,
+        }
+
+    def to_json(self):
+        return json.dumps(self.as_dict())
+
+
+def main(action):
+    """
+    run action(hostname, report) for each host in the command line,
+    or in the JSON list read from stdin if the only host is "-".
+    Exit with 1 if any action raised an exception or, with --json,
+    if any myaq command failed. Without --json, a failed myaq command
+    is only shown in the output, as it always was.
+    """
+    args = sys.argv[1:]
+    as_json = "--json" in args
+    hostnames = [arg for arg in args if arg != "--json"]
+    if hostnames == ["-"]:
+        hostnames = json.load(sys.stdin)
+    if not hostnames:
+        sys.exit(f"usage: {sys.argv[0]} [--json] HOSTNAME [HOSTNAME ...] | -")
+
+    failed = False
+    for hostname in hostnames:
+        report = Report(hostname)
+        try:
+            action(hostname, report)
+        except Exception:
+            report.exception()
+            failed = True
+            if not as_json:
+                traceback.print_exc()
+        if as_json and report.rc != 0:
+            failed = True
+        if as_json:
+            print(report.to_json(), flush=True)
+        else:
+            sys.stdout.write(report.out.getvalue())
+    if failed:
+        sys.exit(1)
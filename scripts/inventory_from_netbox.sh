@@ -7,7 +7,8 @@ LOGFILE="${LOGFILEDIR}/logs_inventory_netbox_${current_datetime}"
 
 source ~/kayobe-prod/env-vars.sh
 
-kayobe playbook run ansible/build-inventory-from-netbox.yml &> $LOGFILE
-
-${HOME}/hv_migration_scripts/parse_logfile.sh $LOGFILE
-exit $?
+# stream the output, so it can be parsed while the playbook runs,
+# and keep a copy in the logfile
+echo "The full path to the logfile is $LOGFILE"
+kayobe playbook run ansible/build-inventory-from-netbox.yml 2>&1 | tee $LOGFILE
+exit ${PIPESTATUS[0]}
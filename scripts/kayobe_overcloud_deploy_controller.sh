@@ -8,7 +8,8 @@ LOGFILE="${LOGFILEDIR}/logs_overcloud_deploy_controller_${current_datetime}"
 
 source ~/kayobe-prod/env-vars.sh
 
-kayobe overcloud service deploy -kl controllers --limit controllers -kt common &> $LOGFILE
-
-${HOME}/hv_migration_scripts/parse_logfile.sh $LOGFILE
-exit $?
+# stream the output, so it can be parsed while the playbook runs,
+# and keep a copy in the logfile
+echo "The full path to the logfile is $LOGFILE"
+kayobe overcloud service deploy -kl controllers --limit controllers -kt common 2>&1 | tee $LOGFILE
+exit ${PIPESTATUS[0]}
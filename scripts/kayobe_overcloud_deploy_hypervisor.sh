@@ -36,7 +36,8 @@ LOGFILE="${LOGFILEDIR}/logs_overcloud_deploy_hypervisor_${HYPERVISORS_UNDER}_${c
 
 source ~/kayobe-prod/env-vars.sh
 
-kayobe overcloud service deploy -kl ${HYPERVISORS_COLON} --limit ${HYPERVISORS_COLON} &> $LOGFILE
-
-${HOME}/hv_migration_scripts/parse_logfile.sh $LOGFILE
-exit $?
+# stream the output, so it can be parsed while the playbook runs,
+# and keep a copy in the logfile
+echo "The full path to the logfile is $LOGFILE"
+kayobe overcloud service deploy -kl ${HYPERVISORS_COLON} --limit ${HYPERVISORS_COLON} 2>&1 | tee $LOGFILE
+exit ${PIPESTATUS[0]}
@@ -1,5 +1,4 @@
-import sys
-sys.path.append("/var/quattor/templates/wup22514/lib/python/")
+import aqactions
 
 from myaq.host import Host
 from myaq.personality import Personality
@@ -8,41 +7,35 @@ from myaq.profile import Profile
 from myaq.operatingsystem import OperatingSystem
 
 
-hv_name = sys.argv[1]
-hv = Host(hv_name)
-
-# 
-# Manage the Hypervisor to the right Domain
-#
-#domain = Domain("prod_cloud_hvs")
-domain = Domain("prod")
-results = domain._manage_host(hv)
-print("cmd: ")
-print(results.cmd)
-print("stdout: ")
-print(results.out)
-print("stderr: ")
-print(results.err)
-print("rc: ")
-print(results.rc)
-if results.rc != 0:
-    sys.exit()
-
-
-# 
-# Recompile the Hypervisor with the right Personality and OS version
-#
-personality = Personality("kayobe-prod", archetype=None)
-os = OperatingSystem("rocky", "9x-x86_64")
-profile = Profile(personality=personality, archetype=None, os=os)
-results = hv.make_profile(profile)
-print("cmd: ")
-print(results.cmd)
-print("stdout: ")
-print(results.out)
-print("stderr: ")
-print(results.err)
-print("rc: ")
-print(results.rc)
-if results.rc != 0:
-    sys.exit()
+def manage_host(hv_name, report):
+    hv = Host(hv_name)
+
+    # 
+    # Manage the Hypervisor to the right Domain
+    #
+    #domain = Domain("prod_cloud_hvs")
+    domain = Domain("prod")
+    results = domain._manage_host(hv)
+    return report.results(results)
+
+
+def make_profile(hv_name, report):
+    hv = Host(hv_name)
+
+    # 
+    # Recompile the Hypervisor with the right Personality and OS version
+    #
+    personality = Personality("kayobe-prod", archetype=None)
+    os = OperatingSystem("rocky", "9x-x86_64")
+    profile = Profile(personality=personality, archetype=None, os=os)
+    results = hv.make_profile(profile)
+    return report.results(results)
+
+
+def make_host(hv_name, report):
+    if manage_host(hv_name, report):
+        make_profile(hv_name, report)
+
+
+if __name__ == "__main__":
+    aqactions.main(make_host)
@@ -36,7 +36,8 @@ LOGFILE="${LOGFILEDIR}/logs_mellanox_${HYPERVISORS_UNDER}_${current_datetime}"
 
 source ~/kayobe-prod/env-vars.sh
 
-ansible-playbook ansible/mellanox-enable-uefi-pxe.yml -i ${HYPERVISORS_COMMA}, --extra-vars "pxe_target=${HYPERVISORS_COLON}" &> $LOGFILE
-
-${HOME}/hv_migration_scripts/parse_logfile.sh $LOGFILE
-exit $?
+# stream the output, so it can be parsed while the playbook runs,
+# and keep a copy in the logfile
+echo "The full path to the logfile is $LOGFILE"
+ansible-playbook ansible/mellanox-enable-uefi-pxe.yml -i ${HYPERVISORS_COMMA}, --extra-vars "pxe_target=${HYPERVISORS_COLON}" 2>&1 | tee $LOGFILE
+exit ${PIPESTATUS[0]}
@@ -0,0 +1,103 @@
+"""
+Resident worker running myaq actions on the Aquilon host
+
+It imports myaq once, and then reads requests, one JSON document per
+line, from stdin, until stdin is closed:
+
+    {"id": 1, "action": "make_host", "hostname": "HOSTNAME"}
+
+For each request, it writes one JSON line to stdout, with the id of the
+request and the hostname, cmd, out, err and rc of the action, like the
+--json output of the helper scripts.
+
+Actions:
+    manage             manage the host to the prod domain
+    make               recompile the host with the right personality and OS
+    make_host          manage + make
+    pxeswitch_host     pxeswitch the host
+    remove_interfaces  remove interfaces other than bmc0 and eth0
+    remove_sata_disk   remove the sda disk
+    get_model          print the hardware model of the host
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import aqactions
+from make_host import manage_host, make_profile, make_host
+from pxeswitch_host import pxeswitch_host
+from remove_interfaces import remove_interfaces
+from remove_sata_disk import remove_sata_disk
+
+
+def get_model(hv_name, report):
+    cmd = ["myaq-get-model", hv_name]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    report.cmds.append(" ".join(cmd))
+    report.out.write(proc.stdout.strip())
+    if proc.stderr:
+        report.err.append(proc.stderr.strip())
+    report.rc = proc.returncode
+
+
+ACTIONS = {
+    "manage": manage_host,
+    "make": make_profile,
+    "make_host": make_host,
+    "pxeswitch_host": pxeswitch_host,
+    "remove_interfaces": remove_interfaces,
+    "remove_sata_disk": remove_sata_disk,
+    "get_model": get_model,
+}
+
+
+def handle(request):
+    report = aqactions.Report(request.get("hostname"))
+    # anything printed by the action, or its children, is added to its output
+    with tempfile.TemporaryFile("w+") as output:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved = [os.dup(1), os.dup(2)]
+        os.dup2(output.fileno(), 1)
+        os.dup2(output.fileno(), 2)
+        try:
+            action = ACTIONS[request["action"]]
+            action(request["hostname"], report)
+        except Exception:
+            report.exception()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            for fd in saved:
+                os.close(fd)
+        output.seek(0)
+        printed = output.read()
+    if printed:
+        report.print(printed.rstrip())
+    response = report.as_dict()
+    response["id"] = request.get("id")
+    return response
+
+
+def main():
+    # keep stdout for the responses only
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as ex:
+            response = {"id": None, "hostname": None, "cmd": "", "out": "", "err": f"invalid request: {ex}", "rc": 1}
+        else:
+            response = handle(request)
+        responses.write(json.dumps(response) + "\n")
+        responses.flush()
+
+
+if __name__ == "__main__":
+    main()
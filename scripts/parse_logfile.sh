@@ -19,6 +19,10 @@
 # Finally, we check if the variable where we stored the failure paragraphs is
 # empty or not, and we return either 0 or 1 based on that.
 #
+# The wrapper scripts now stream the playbook output, which is parsed by
+# lib/ansibleoutput.py as it runs, so this script is only useful to read
+# a logfile by hand.
+#
 # ============================================================================== 
 
 LOGFILE=$1
@@ -1,21 +1,14 @@
-import sys
-sys.path.append("/var/quattor/templates/wup22514/lib/python/")
+import aqactions
 
 from myaq.host import Host
 
 
-hv_name = sys.argv[1]
-hv = Host(hv_name)
+def pxeswitch_host(hv_name, report):
+    hv = Host(hv_name)
 
-results = hv.pxeswitch_install()
-print("cmd: ")
-print(results.cmd)
-print("stdout: ")
-print(results.out)
-print("stderr: ")
-print(results.err)
-print("rc: ")
-print(results.rc)
-if results.rc != 0:
-    sys.exit()
+    results = hv.pxeswitch_install()
+    report.results(results)
 
+
+if __name__ == "__main__":
+    aqactions.main(pxeswitch_host)
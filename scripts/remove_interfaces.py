@@ -1,45 +1,40 @@
-import sys
-sys.path.append("/var/quattor/templates/wup22514/lib/python/")
+import aqactions
 
 from myaq.host import Host
 
 
+def print_interfaces(hv, report):
+    interfaces = hv.interfaces
+    for interface in interfaces:
+        report.print(interface.name)
+        report.print(interface.addr)
+        report.print(interface.ip)
+        report.print()
+    return interfaces
 
-hv_name = sys.argv[1]
-hv = Host(hv_name)
-
-machine = hv.machine
-
-print(f"Interfaces information for HV {hv.name}\n")
-interfaces = hv.interfaces
-for interface in interfaces:
-    print(interface.name)
-    print(interface.addr)
-    print(interface.ip)
-    print()
-
-for interface in interfaces:
-    if interface.name not in ["bmc0", "eth0"]:
-        if interface.ip != "":
-            print(f"deleting interface address {interface.ip} for interface {interface.name} for HV {hv.name}")
-            results = machine.remove_interface_address(interface)
-            print(f"command: {results.cmd}")
-            print(f"stdout: {results.out}")
-            print(f"stderr: {results.err}")
-            print(f"return code: {results.rc}")
-        print(f"deleting interface {interface.name} for HV {hv.name}")
-        results = machine.remove_interface(interface)
-        print(f"command: {results.cmd}")
-        print(f"stdout: {results.out}")
-        print(f"stderr: {results.err}")
-        print(f"return code: {results.rc}")
-
-hv = Host(hv_name)
-print(f"Updated list of interfaces for  HV {hv.name}\n")
-interfaces = hv.interfaces
-for interface in interfaces:
-    print(interface.name)
-    print(interface.addr)
-    print(interface.ip)
-    print()
 
+def remove_interfaces(hv_name, report):
+    hv = Host(hv_name)
+
+    machine = hv.machine
+
+    report.print(f"Interfaces information for HV {hv.name}\n")
+    interfaces = print_interfaces(hv, report)
+
+    for interface in interfaces:
+        if interface.name not in ["bmc0", "eth0"]:
+            if interface.ip != "":
+                report.print(f"deleting interface address {interface.ip} for interface {interface.name} for HV {hv.name}")
+                results = machine.remove_interface_address(interface)
+                report.results(results, compact=True)
+            report.print(f"deleting interface {interface.name} for HV {hv.name}")
+            results = machine.remove_interface(interface)
+            report.results(results, compact=True)
+
+    hv = Host(hv_name)
+    report.print(f"Updated list of interfaces for  HV {hv.name}\n")
+    print_interfaces(hv, report)
+
+
+if __name__ == "__main__":
+    aqactions.main(remove_interfaces)